@@ -0,0 +1,82 @@
+"""
+Hot/archive split: message pages and inserts before and after
+archive_messages moves most of the history out of the hot table, the cost
+of paging back into archived ranges, and the size of the hot table, its
+indexes and the full-text index.
+"""
+import argparse
+import base64
+import time
+from datetime import timedelta
+
+from common import make_conversation, make_users, report, setup_database, timeit
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chats.archive import archive_messages
+from chats.models import Message
+
+# DRF cursor for the newest page: reversed, no position
+NEWEST = base64.b64encode(b'r=1').decode()
+
+
+def table_bytes(like):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name LIKE %s)",
+            [like],
+        )
+        return cursor.fetchone()[0]
+
+
+def sizes():
+    return (f"hot table+indexes {table_bytes('chats_message') / 2**20:6.1f} MiB  "
+            f"search index {table_bytes('chats_message_fts%') / 2**20:6.1f} MiB  "
+            f"archive {table_bytes('chats_archivedmessage') / 2**20:6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--old', type=float, default=0.9, help="Share of each history that is old")
+    args = parser.parse_args()
+
+    setup_database()
+    owner, *others = make_users(args.conversations + 1)
+    conversations = [make_conversation([owner, other], args.messages) for other in others]
+    old = timezone.now() - timedelta(days=400)
+    for conversation in conversations:
+        ids = list(Message.objects.filter(conversation=conversation).order_by('sent_at', 'message_id')
+                   .values_list('pk', flat=True)[:int(args.messages * args.old)])
+        Message.objects.filter(pk__in=ids).update(sent_at=old)
+
+    client = APIClient()
+    client.force_authenticate(owner)
+    url = f'/api/conversations/{conversations[0].pk}/messages/'
+    inserts = iter(range(10**9))
+
+    def measure(label):
+        print(label, sizes())
+        report('  newest page', *timeit(lambda: client.get(f'{url}?cursor={NEWEST}'), repeat=50))
+        report('  oldest page', *timeit(lambda: client.get(url), repeat=50))
+        report('  post message', *timeit(
+            lambda: client.post(url, {'message_body': f'new {next(inserts)}'}, format='json'), repeat=50
+        ))
+
+    print(f'{args.conversations} conversations x {args.messages} messages, {args.old:.0%} old')
+    measure('all hot')
+    start = time.perf_counter()
+    moved = 0
+    for moved in archive_messages():
+        pass
+    elapsed = time.perf_counter() - start
+    print(f'archived {moved} messages in {elapsed:.1f} s ({moved / elapsed:.0f} messages/s)')
+    measure('after archiving')
+
+
+if __name__ == '__main__':
+    main()
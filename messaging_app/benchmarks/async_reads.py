@@ -0,0 +1,73 @@
+"""
+Read throughput and tail latency: the DRF (WSGI) message list with a pool
+of worker threads versus the async view with concurrent tasks on one
+event loop, both at the same number of requests in flight.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import make_conversation, make_users, setup_database
+
+from django.test import AsyncClient, Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+def summarize(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'{label:<28} {len(latencies) / elapsed:8.1f} req/s  '
+          f'p50 {statistics.median(latencies) * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms')
+
+
+def run_wsgi(path, headers, requests, concurrency):
+    client = Client()
+
+    def one(_):
+        start = time.perf_counter()
+        assert client.get(path, headers=headers).status_code == 200
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    summarize('WSGI (DRF, threads)', latencies, time.perf_counter() - start)
+
+
+async def run_asgi(path, headers, requests, concurrency):
+    client = AsyncClient()
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            start = time.perf_counter()
+            assert (await client.get(path, headers=headers)).status_code == 200
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    summarize('ASGI (async view)', latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    conversation = make_conversation([owner, other], 1000)
+    headers = {'Authorization': f'Bearer {AccessToken.for_user(owner)}'}
+    path = f'/conversations/{conversation.pk}/messages/?page_size={args.page_size}'
+
+    print(f'{args.requests} requests, {args.concurrency} in flight, page size {args.page_size}')
+    run_wsgi(f'/api{path}', headers, args.requests, args.concurrency)
+    asyncio.run(run_asgi(f'/api/async{path}', headers, args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
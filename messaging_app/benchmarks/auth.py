@@ -0,0 +1,59 @@
+"""
+Authentication overhead per request: SimpleJWT's JWTAuthentication (one
+user query per request) versus CachedJWTAuthentication (user served from
+the process-local cache after the first request).
+"""
+import argparse
+
+from common import make_users, report, setup_database, timeit
+
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from chats.auth import LoginSerializer
+from chats.authentication import CachedJWTAuthentication, get_user_cache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_database()
+    users = make_users(args.users)
+    factory = RequestFactory()
+    requests = [
+        factory.get('/api/conversations/', HTTP_AUTHORIZATION=f'Bearer {LoginSerializer.get_token(u).access_token}')
+        for u in users
+    ]
+    print(f'{args.requests} authentications across {args.users} users')
+
+    for label, auth in [
+        ('JWTAuthentication', JWTAuthentication()),
+        ('CachedJWTAuthentication', CachedJWTAuthentication()),
+    ]:
+        get_user_cache().clear()
+
+        def run():
+            for i in range(args.requests):
+                user, _ = auth.authenticate(Request(requests[i % len(requests)]))
+                assert user is not None
+
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            run()
+        median, best = timeit(run)
+        per_request = median / args.requests * 1e6
+        report(label, median, best, f'{per_request:6.1f} us/request  {len(queries)} queries (first pass)')
+
+
+if __name__ == '__main__':
+    main()
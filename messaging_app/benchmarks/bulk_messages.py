@@ -0,0 +1,48 @@
+"""
+Message ingestion throughput: one POST per message versus the bulk
+endpoint, across a few batch sizes.
+"""
+import argparse
+import json
+
+from common import make_conversation, make_users, report, setup_database, timeit
+
+from rest_framework.test import APIClient
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    conversation = make_conversation([owner, other], 0)
+    url = f'/api/conversations/{conversation.pk}/messages/'
+    client = APIClient()
+    client.force_authenticate(owner)
+    items = [{'message_body': f'imported message {i}'} for i in range(args.messages)]
+
+    def single():
+        for item in items:
+            client.post(url, item, format='json')
+
+    def bulk(batch_size):
+        return lambda: client.post(f'{url}bulk/?batch_size={batch_size}', items, format='json')
+
+    def bulk_ndjson():
+        body = '\n'.join(json.dumps(item) for item in items)
+        client.post(f'{url}bulk/', body, content_type='application/x-ndjson')
+
+    print(f'{args.messages} messages per run')
+    median, best = timeit(single, repeat=1)
+    report('single POST per message', median, best, f'{args.messages / median:,.0f} msg/s')
+    for batch_size in (50, 500, 2000):
+        median, best = timeit(bulk(batch_size), repeat=3)
+        report(f'bulk JSON, batch_size={batch_size}', median, best, f'{args.messages / median:,.0f} msg/s')
+    median, best = timeit(bulk_ndjson, repeat=3)
+    report('bulk NDJSON, default batch size', median, best, f'{args.messages / median:,.0f} msg/s')
+
+
+if __name__ == '__main__':
+    main()
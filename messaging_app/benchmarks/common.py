@@ -0,0 +1,79 @@
+"""
+Shared setup for the benchmark scripts.
+
+Each script is run from the project directory, e.g.
+``python benchmarks/inbox.py``. Importing this module boots Django and
+creates a throwaway test database so benchmarks never touch db.sqlite3.
+"""
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment
+
+from chats.models import Conversation, CustomUser, Message
+
+
+def setup_database(path=None):
+    """
+    Create the test database: in memory, or in the file at path. Threads
+    share an in-memory database through SQLite's shared cache, where
+    concurrent writers fail with "database table is locked" instead of
+    waiting; a file gets the WAL, busy_timeout and BEGIN IMMEDIATE profile
+    of settings.DATABASES.
+    """
+    setup_test_environment()
+    if path is not None:
+        connection.settings_dict['TEST']['NAME'] = str(path)
+    connection.creation.create_test_db(verbosity=0)
+    # Benchmarks measure throughput, not rate limits
+    override_settings(CHATS_THROTTLE_ENABLED=False).enable()
+
+
+def make_users(count, prefix='user'):
+    users = [
+        CustomUser(email=f'{prefix}{i}@example.com', first_name='Bench',
+                   last_name=str(i), role='guest')
+        for i in range(count)
+    ]
+    for user in users:
+        user.set_unusable_password()
+    return CustomUser.objects.bulk_create(users)
+
+
+def make_conversation(participants, message_count, body='benchmark message body'):
+    conversation = Conversation.objects.create()
+    conversation.participants.set(participants)
+    senders = list(participants)
+    Message.objects.bulk_create(
+        (Message(conversation=conversation, sender=senders[i % len(senders)],
+                 message_body=f'{body} {i}')
+         for i in range(message_count)),
+        batch_size=2000,
+    )
+    conversation.refresh_last_message()
+    return conversation
+
+
+def timeit(fn, repeat=5):
+    """Run fn repeat times and return (median, best) wall time in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), min(samples)
+
+
+def report(label, median, best, extra=''):
+    print(f'{label:<40} median {median * 1000:9.2f} ms  best {best * 1000:9.2f} ms  {extra}')
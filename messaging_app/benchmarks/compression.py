@@ -0,0 +1,120 @@
+"""
+Message body compression on a mixed corpus: mostly short chat lines, plus
+integration payloads (JSON webhooks and log excerpts of a few KB).
+
+Loads the corpus uncompressed, measures table size, inserts and page
+latency, then compresses it with the compress_messages command and
+measures again.
+"""
+import argparse
+import io
+import json
+import random
+
+from common import make_users, report, setup_database, timeit
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from chats.models import Conversation, Message
+
+WORDS = ('the deploy build failed passed retry ok thanks see you tomorrow meeting notes please review '
+         'merged ticket customer invoice shipped delayed order refund lunch call later ping ack').split()
+
+
+def chat_line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+
+
+def webhook(rng):
+    return json.dumps({
+        'event': rng.choice(['order.created', 'invoice.paid', 'build.finished']),
+        'id': f'evt_{rng.getrandbits(64):016x}',
+        'data': {'items': [
+            {'sku': f'SKU-{rng.randint(1000, 9999)}', 'quantity': rng.randint(1, 5),
+             'price': {'amount': rng.randint(100, 99999), 'currency': 'EUR'},
+             'description': chat_line(rng)}
+            for _ in range(rng.randint(10, 60))
+        ]},
+    }, indent=2)
+
+
+def log_excerpt(rng):
+    return '\n'.join(
+        f'2026-10-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z '
+        f'{rng.choice(["INFO", "WARN", "ERROR"])} worker-{rng.randint(1, 8)} {chat_line(rng)}'
+        for _ in range(rng.randint(30, 150))
+    )
+
+
+def corpus(count, large_share, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        if rng.random() < large_share:
+            yield rng.choice([webhook, log_excerpt])(rng)
+        else:
+            yield chat_line(rng)
+
+
+def table_bytes():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name = 'chats_message')"
+        )
+        return cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--large-share', type=float, default=0.1)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    conversation = Conversation.objects.create()
+    conversation.participants.set([owner, other])
+    bodies = list(corpus(args.messages, args.large_share))
+    large = [b for b in bodies if len(b.encode()) >= 1024]
+    print(f'{args.messages} messages, {len(large)} of at least 1 KiB '
+          f'(median {sorted(map(len, large))[len(large) // 2]} bytes), '
+          f'{sum(len(b.encode()) for b in bodies) / 2**20:.1f} MiB of text')
+
+    with override_settings(CHATS_MESSAGE_COMPRESSION_THRESHOLD=10**9):
+        Message.objects.bulk_create(
+            (Message(conversation=conversation, sender=owner, message_body=b) for b in bodies), batch_size=2000
+        )
+
+    client = APIClient()
+    client.force_authenticate(owner)
+    url = f'/api/conversations/{conversation.pk}/messages/?page_size=100'
+    scratch = Conversation.objects.create()
+    sample = bodies[:5000]
+
+    def insert():
+        Message.objects.bulk_create(
+            (Message(conversation=scratch, sender=owner, message_body=b) for b in sample), batch_size=2000
+        )
+        Message.objects.filter(conversation=scratch).delete()
+
+    def measure(label, threshold):
+        print(f'{label}: messages table + indexes {table_bytes() / 2**20:.1f} MiB')
+        report('  page of 100 (fast path)', *timeit(lambda: client.get(url), repeat=30))
+        with override_settings(CHATS_FAST_SERIALIZATION=False):
+            report('  page of 100 (serializer)', *timeit(lambda: client.get(url), repeat=30))
+        with override_settings(CHATS_MESSAGE_COMPRESSION_THRESHOLD=threshold):
+            report('  insert 5000 + delete', *timeit(insert, repeat=3))
+
+    measure('uncompressed', 10**9)
+    out = io.StringIO()
+    call_command('compress_messages', stdout=out)
+    connection.cursor().execute('VACUUM')
+    print(out.getvalue().strip().splitlines()[0])
+    measure('compressed', 1024)
+
+
+if __name__ == '__main__':
+    main()
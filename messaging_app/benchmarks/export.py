@@ -0,0 +1,52 @@
+"""
+Streaming export memory: stream a conversation's history through the
+export action and track resident memory while consuming it. The growth
+should stay flat as the history grows; the script exits non-zero when it
+exceeds --max-rss-growth (Linux only: reads /proc).
+"""
+import argparse
+import os
+import time
+
+from common import make_conversation, make_users, setup_database
+
+from rest_framework.test import APIClient
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--as', dest='kind', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--max-rss-growth', type=float, default=50.0, help='MB')
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    client = APIClient()
+    client.force_authenticate(owner)
+
+    for count in args.messages:
+        conversation = make_conversation([owner, other], count)
+        response = client.get(f'/api/conversations/{conversation.pk}/export/?as={args.kind}')
+        start_rss = peak_rss = rss_mb()
+        start, size = time.perf_counter(), 0
+        for i, chunk in enumerate(response.streaming_content):
+            size += len(chunk)
+            if i % 50 == 0:
+                peak_rss = max(peak_rss, rss_mb())
+        elapsed = time.perf_counter() - start
+        print(f'{count:>10,} messages  {size / 2**20:8.1f} MB streamed in {elapsed:6.1f} s  '
+              f'RSS growth {peak_rss - start_rss:6.1f} MB')
+        if peak_rss - start_rss > args.max_rss_growth:
+            raise SystemExit(f'RSS grew more than {args.max_rss_growth} MB')
+
+
+if __name__ == '__main__':
+    main()
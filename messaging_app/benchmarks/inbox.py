@@ -0,0 +1,56 @@
+"""
+Inbox payload size and latency: compact inbox rows versus conversations
+that embed their full message history, at 10k messages per conversation.
+"""
+import argparse
+
+from common import make_conversation, make_users, report, setup_database, timeit
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from chats.models import Conversation
+from chats.serializers import ConversationSerializer, MessageSerializer
+
+
+class EmbeddedHistorySerializer(ConversationSerializer):
+    """The pre-inbox list representation, kept here as the baseline."""
+    messages = MessageSerializer(many=True, read_only=True)
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ConversationSerializer.Meta.fields + ['messages']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=10_000)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, *others = make_users(args.conversations + 1)
+    for other in others:
+        make_conversation([owner, other], args.messages)
+
+    client = APIClient()
+    client.force_authenticate(owner)
+    size = {}
+
+    def inbox():
+        response = client.get('/api/conversations/')
+        size['inbox'] = len(response.content)
+
+    def embedded():
+        queryset = Conversation.objects.filter(participants=owner).prefetch_related(
+            'participants', 'messages__sender'
+        )
+        body = JSONRenderer().render(EmbeddedHistorySerializer(queryset, many=True).data)
+        size['embedded'] = len(body)
+
+    print(f'{args.conversations} conversations x {args.messages} messages')
+    report('inbox list (compact)', *timeit(inbox), f'{size["inbox"]:,} bytes')
+    report('embedded history (baseline)', *timeit(embedded, repeat=3), f'{size["embedded"]:,} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Cost of InstrumentationMiddleware and the query execute wrapper per request.
+
+Serves a mix of inbox and message-page reads through the full middleware
+stack with instrumentation removed (no middleware, no execute wrapper)
+and at several sample rates. Profiles run in a shuffled order each round
+and the median round is reported, so drift on a busy machine hits all of
+them. End-to-end differences of a few percent are within that noise, so
+the fixed cost is also measured directly: the middleware around a no-op
+view and the wrapper around a no-op execute, scaled to the queries an
+average request runs.
+
+    python benchmarks/instrumentation.py --rounds 15
+"""
+import argparse
+import random
+import statistics
+import time
+
+from common import make_conversation, make_users, setup_database
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from chats.instrumentation import measure_request, record_query
+from chats.middleware import InstrumentationMiddleware
+
+
+def per_call(fn, number=200_000):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+
+def fixed_costs(queries_per_request):
+    """Seconds added per request by the middleware and wrapper, by sample rate."""
+    request = RequestFactory().get('/api/conversations/')
+    response = HttpResponse(b'x' * 2000)
+    bare = per_call(lambda: response)
+    middleware = InstrumentationMiddleware(lambda request: response)
+    costs = {}
+    for rate in (0, 0.1, 1):
+        with override_settings(CHATS_INSTRUMENTATION_SAMPLE_RATE=rate):
+            costs[rate] = per_call(lambda: middleware(request)) - bare
+
+    def execute(sql, params, many, context):
+        pass
+
+    def wrapper_cost():
+        return per_call(lambda: record_query(execute, '', (), False, {})) - per_call(lambda: execute('', (), False, {}))
+
+    unsampled = wrapper_cost()
+    with measure_request():
+        sampled = wrapper_cost()
+    return {
+        rate: cost + queries_per_request * (rate * sampled + (1 - rate) * unsampled)
+        for rate, cost in costs.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=300, help="Requests per round and profile")
+    parser.add_argument('--rounds', type=int, default=15)
+    args = parser.parse_args()
+
+    setup_database()
+    users = make_users(args.users)
+    conversations = [make_conversation([users[i], users[(i + 1) % len(users)]], 200) for i in range(len(users))]
+    clients = []
+    for user in users:
+        client = APIClient()
+        client.force_authenticate(user)
+        clients.append(client)
+
+    def serve():
+        start = time.perf_counter()
+        for i in range(args.requests):
+            n = i % len(users)
+            url = '/api/conversations/' if i % 2 else f'/api/conversations/{conversations[n].pk}/messages/'
+            assert clients[n].get(url).status_code == 200
+        return (time.perf_counter() - start) / args.requests
+
+    uninstrumented = [m for m in settings.MIDDLEWARE if m != 'chats.middleware.InstrumentationMiddleware']
+    profiles = {
+        'off': {'MIDDLEWARE': uninstrumented},
+        'rate 0': {'CHATS_INSTRUMENTATION_SAMPLE_RATE': 0},
+        'rate 0.1': {'CHATS_INSTRUMENTATION_SAMPLE_RATE': 0.1},
+        'rate 1': {'CHATS_INSTRUMENTATION_SAMPLE_RATE': 1},
+        'rate 1 + Server-Timing': {'CHATS_INSTRUMENTATION_SAMPLE_RATE': 1, 'CHATS_SERVER_TIMING': True},
+    }
+    samples = {label: [] for label in profiles}
+    with CaptureQueriesContext(connection) as queries:
+        serve()  # warm up
+    queries_per_request = len(queries) / args.requests
+    order = list(profiles)
+    for _ in range(args.rounds):
+        random.shuffle(order)
+        for label in order:
+            overrides = profiles[label]
+            off = label == 'off'
+            if off:
+                connection.execute_wrappers.remove(record_query)
+            with override_settings(**overrides):
+                samples[label].append(serve())
+            if off:
+                connection.execute_wrappers.append(record_query)
+
+    baseline = statistics.median(samples['off'])
+    print(f'{args.requests} requests x {args.rounds} rounds per profile (inbox and message pages)')
+    for label, values in samples.items():
+        median = statistics.median(values)
+        print(f'{label:<24} {median * 1e6:7.0f} us/request  {median / baseline - 1:+6.2%}')
+
+    print(f'Fixed cost per request ({queries_per_request:.1f} queries each):')
+    for rate, cost in fixed_costs(queries_per_request).items():
+        print(f'rate {rate:<19} {cost * 1e6:7.1f} us/request  {cost / baseline:+6.2%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Login throughput under a concurrent signup burst, hashing inline on the
+request threads versus on the bounded hashing pool, alongside the latency
+of a cheap authenticated read served by the same threads.
+
+Signups write concurrently, so the test database is a file in a
+temporary directory with the settings.DATABASES profile (WAL,
+busy_timeout, BEGIN IMMEDIATE); see common.setup_database(). Published
+numbers are from 1 CPU with the defaults:
+
+    python benchmarks/password_hashing.py --iterations 600000 100000 \
+        --logins 8 --signups 16 --seconds 10
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from common import make_users, setup_database
+
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.hashers import get_hashing_pool
+from chats.models import CustomUser
+
+
+def p99(samples):
+    samples = sorted(samples)
+    return samples[max(0, int(len(samples) * 0.99) - 1)]
+
+
+def run(label, args, run_id):
+    stop = time.perf_counter() + args.seconds
+    logins, signups, reads = [], [], []
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+
+    def login_loop(i):
+        client = Client()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            response = client.post('/api/login/', {'email': f'login{i}@example.com', 'password': 'pass1234'},
+                                   content_type='application/json')
+            if response.status_code == 200:
+                with lock:
+                    logins.append(time.perf_counter() - start)
+
+    def signup_loop(_):
+        client = Client()
+        while time.perf_counter() < stop:
+            with lock:
+                n = next(counter)
+            response = client.post('/api/register/', {
+                'email': f'signup-{run_id}-{n}@example.com', 'password': 'pass1234',
+                'first_name': 'Load', 'last_name': 'Test', 'role': 'guest',
+            }, content_type='application/json')
+            if response.status_code == 201:
+                with lock:
+                    signups.append(n)
+
+    def read_loop(headers):
+        client = Client()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            assert client.get('/api/conversations/', headers=headers).status_code == 200
+            with lock:
+                reads.append(time.perf_counter() - start)
+
+    headers = {'Authorization': f'Bearer {AccessToken.for_user(CustomUser.objects.get(email="reader0@example.com"))}'}
+    with ThreadPoolExecutor(args.logins + args.signups + 1) as threads:
+        futures = [threads.submit(login_loop, i) for i in range(args.logins)]
+        futures += [threads.submit(signup_loop, i) for i in range(args.signups)]
+        futures.append(threads.submit(read_loop, headers))
+    for future in futures:
+        future.result()
+
+    print(f'{label:<24} logins {len(logins) / args.seconds:6.1f}/s (p99 {p99(logins) * 1000:7.1f} ms)  '
+          f'signups {len(signups) / args.seconds:6.1f}/s  '
+          f'reads p50 {statistics.median(reads) * 1000:6.1f} ms p99 {p99(reads) * 1000:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, nargs='+', default=[600000, 100000])
+    parser.add_argument('--logins', type=int, default=8)
+    parser.add_argument('--signups', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None, help='pool size (default: CPU count)')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    setup_database(Path(directory.name) / 'password_hashing.sqlite3')
+    make_users(1, prefix='reader')
+    for iterations in args.iterations:
+        with override_settings(CHATS_PASSWORD_HASH_ITERATIONS=iterations):
+            CustomUser.objects.filter(email__startswith='login').delete()
+            for i in range(args.logins):
+                CustomUser.objects.create_user(email=f'login{i}@example.com', password='pass1234',
+                                               first_name='Load', last_name='Test', role='guest')
+            print(f'{iterations} PBKDF2 iterations, {args.logins} login and {args.signups} signup threads')
+            modes = [('inline', 0), ('pool', args.workers or None)]
+            for label, workers in modes:
+                overrides = {'CHATS_PASSWORD_HASH_WORKERS': workers} if workers is not None else {}
+                with override_settings(**overrides):
+                    get_hashing_pool.cache_clear()
+                    run(label, args, f'{iterations}-{label}')
+            get_hashing_pool.cache_clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Refresh latency as revocations pile up: POST /api/refresh/ with rotation
+(each call revokes the old token) at growing RevokedToken table sizes,
+plus the cost of a negative is_revoked() check against the Bloom filter.
+"""
+import argparse
+from datetime import timedelta
+
+from common import make_users, report, setup_database, timeit
+
+from django.test import Client
+from django.utils import timezone
+
+from chats.auth import LoginSerializer
+from chats.models import RevokedToken
+from chats.revocation import get_revocation_store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 10000, 100000, 500000])
+    parser.add_argument('--refreshes', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_database()
+    user = make_users(1)[0]
+    client = Client()
+    store = get_revocation_store()
+    expires_at = timezone.now() + timedelta(days=7)
+    revoked = 0
+
+    for size in args.sizes:
+        RevokedToken.objects.bulk_create(
+            (RevokedToken(jti=f'bench-{i}', expires_at=expires_at) for i in range(revoked, size)),
+            batch_size=5000,
+        )
+        revoked = max(revoked, size)
+        store.compact()
+
+        token = str(LoginSerializer.get_token(user))
+
+        def run():
+            nonlocal token
+            for _ in range(args.refreshes):
+                response = client.post('/api/refresh/', {'refresh': token}, content_type='application/json')
+                token = response.json()['refresh']
+
+        median, best = timeit(run)
+        report(f'refresh, {size:>7} revoked', median / args.refreshes, best / args.refreshes, 'per refresh')
+
+        median, best = timeit(lambda: [store.is_revoked(f'fresh-{i}') for i in range(10000)])
+        report(f'negative check, {size:>7} revoked', median / 10000, best / 10000, 'per check')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Inbox and message-page reads with and without read replicas.
+
+The primary is a SQLite file in a temporary directory and the replicas are
+plain copies of it, so this measures where queries go and what routing
+costs per request, not replication itself. A writer posts a message every
+--write-every requests to show read-your-writes pinning.
+
+    python benchmarks/replica_routing.py --replicas 2
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--replicas', type=int, default=2)
+parser.add_argument('--users', type=int, default=50)
+parser.add_argument('--requests', type=int, default=2000)
+parser.add_argument('--write-every', type=int, default=20)
+parser.add_argument('--rounds', type=int, default=2, help="Alternate the profiles; the first round warms up")
+args = parser.parse_args()
+
+directory = tempfile.mkdtemp()
+os.environ['DJANGO_DB_REPLICAS'] = ','.join(
+    str(Path(directory) / f'replica{n}.sqlite3') for n in range(1, args.replicas + 1)
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from chats.authentication import get_user_cache  # noqa: E402
+from common import make_conversation, make_users  # noqa: E402
+
+
+def build_primary():
+    connections['default'].settings_dict['NAME'] = str(Path(directory) / 'primary.sqlite3')
+    connections.close_all()
+    call_command('migrate', verbosity=0)
+    users = make_users(args.users)
+    conversations = [make_conversation([users[i], users[(i + 1) % len(users)]], 200) for i in range(len(users))]
+    connections.close_all()
+    for alias in settings.CHATS_READ_REPLICAS:
+        shutil.copy(connections['default'].settings_dict['NAME'], connections[alias].settings_dict['NAME'])
+    return users, conversations
+
+
+def run(label, users, conversations, replicas):
+    counts = Counter()
+    # Cached users remember the database they were loaded from
+    get_user_cache().clear()
+
+    def count(alias):
+        def wrapper(execute, sql, params, many, context):
+            counts[alias] += 1
+            return execute(sql, params, many, context)
+        return wrapper
+
+    clients = []
+    for user in users:
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        clients.append(client)
+
+    wrappers = [connections[alias].execute_wrapper(count(alias)) for alias in ['default', *replicas]]
+    with override_settings(CHATS_READ_REPLICAS=replicas):
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        start = time.perf_counter()
+        for i in range(args.requests):
+            n = i % len(users)
+            url = f'/api/conversations/{conversations[n].pk}/messages/'
+            if args.write_every and i % args.write_every == 0:
+                assert clients[n].post(url, {'message_body': 'hi'}, format='json').status_code == 201
+            elif i % 2:
+                assert clients[n].get('/api/conversations/').status_code == 200
+            else:
+                assert clients[n].get(url).status_code == 200
+        elapsed = time.perf_counter() - start
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
+    total = sum(counts.values())
+    shares = '  '.join(f'{alias} {counts[alias] / total:5.1%}' for alias in ['default', *replicas])
+    print(f'{label:<12} {elapsed / args.requests * 1e6:7.0f} us/request  queries: {shares}')
+
+
+def main():
+    setup_test_environment()
+    try:
+        users, conversations = build_primary()
+        print(f'{args.requests} requests from {args.users} users, one write per {args.write_every}')
+        for _ in range(args.rounds):
+            run('primary', users, conversations, [])
+            run(f'{args.replicas} replicas', users, conversations, settings.CHATS_READ_REPLICAS)
+    finally:
+        connections.close_all()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Search latency: SQLite FTS5 backend versus unindexed icontains over a large
+synthetic corpus spread across many conversations.
+"""
+import argparse
+import random
+
+from common import make_users, report, setup_database, timeit
+
+from chats.models import Conversation, Message
+from chats.search import IContainsSearchBackend, SQLiteFTS5SearchBackend
+
+WORDS = [f'w{i}' for i in range(5000)] + ['deploy', 'invoice', 'lunch', 'meeting', 'release']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    rng = random.Random(42)
+    conversations = []
+    for _ in range(args.conversations):
+        conversation = Conversation.objects.create()
+        conversation.participants.set([owner, other])
+        conversations.append(conversation)
+    per = args.messages // args.conversations
+    for conversation in conversations:
+        Message.objects.bulk_create(
+            (Message(conversation=conversation, sender=owner,
+                     message_body=' '.join(rng.choices(WORDS, k=12)))
+             for _ in range(per)),
+            batch_size=5000,
+        )
+
+    ids = [c.pk for c in conversations]
+    print(f'{per * args.conversations:,} messages in {args.conversations} conversations')
+    for query in ['deploy', 'deploy invoice', 'w42', 'rel']:
+        for label, backend in [('fts5', SQLiteFTS5SearchBackend()), ('icontains', IContainsSearchBackend())]:
+            report(f'{label:<9} q={query!r}', *timeit(lambda: backend.search(ids, query, 20, 0), repeat=3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Message list serialization: MessageSerializer + stdlib JSONRenderer versus
+values() rows + FastJSONRenderer, with and without orjson.
+"""
+import argparse
+from unittest import mock
+
+from common import make_conversation, make_users, report, setup_database, timeit
+
+from rest_framework.renderers import JSONRenderer
+
+from chats import renderers
+from chats.renderers import FastJSONRenderer
+from chats.serializers import MessageSerializer, message_rows, message_values
+from chats.queries import conversation_messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    args = parser.parse_args()
+
+    setup_database()
+    users = make_users(2)
+    print(f'orjson available: {renderers.orjson is not None}')
+    for size in args.sizes:
+        conversation = make_conversation(users, size)
+        queryset = conversation_messages(conversation.pk)
+
+        def drf():
+            return JSONRenderer().render(MessageSerializer(queryset.all(), many=True).data)
+
+        def fast():
+            return FastJSONRenderer().render(message_rows(message_values(queryset.all())))
+
+        def fast_stdlib():
+            with mock.patch.object(renderers, 'orjson', None):
+                return fast()
+
+        assert drf() == fast() == fast_stdlib()
+        repeat = 5 if size <= 10_000 else 2
+        print(f'-- {size:,} messages')
+        report('MessageSerializer + JSONRenderer', *timeit(drf, repeat))
+        report('values() rows + stdlib json', *timeit(fast_stdlib, repeat))
+        report('values() rows + orjson', *timeit(fast, repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Concurrent reads and writes against a file-backed SQLite database, with
+Django's default connection settings versus the OPTIONS profile in
+settings.DATABASES (WAL, relaxed fsync, BEGIN IMMEDIATE). Writers post
+messages through the ORM path MessageViewSet uses; readers list the newest page of a conversation. Each profile gets a fresh
+database file in a temporary directory.
+
+In-memory databases (what the other benchmarks use) have no journal, so
+this one does not use common.setup_database().
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+
+from chats.models import Conversation, CustomUser, Message
+from chats.queries import conversation_messages
+
+
+def run_profile(label, options, args, directory):
+    # Every thread's connection shares this settings dict
+    settings_dict = connections['default'].settings_dict
+    settings_dict['NAME'] = str(Path(directory) / f'{label}.sqlite3')
+    settings_dict['OPTIONS'] = options
+    connections.close_all()
+    call_command('migrate', verbosity=0)
+    users = [
+        CustomUser.objects.create_user(email=f'{label}{i}@example.com', password=None, first_name='B',
+                                       last_name=str(i), role='guest')
+        for i in range(args.writers)
+    ]
+    conversation = Conversation.objects.create()
+    conversation.participants.set(users)
+    journal = connection.cursor().execute('PRAGMA journal_mode').fetchone()[0]
+    connections.close_all()
+
+    stop = time.perf_counter() + args.seconds
+    writes, reads, errors = [], [], []
+    lock = threading.Lock()
+
+    def writer(user):
+        try:
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        message = Message.objects.create(conversation=conversation, sender=user,
+                                                         message_body='benchmark message body')
+                        conversation.record_message(message)
+                except OperationalError as exc:
+                    with lock:
+                        errors.append(str(exc))
+                    continue
+                with lock:
+                    writes.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    def reader(_):
+        try:
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                try:
+                    list(conversation_messages(conversation.pk).order_by('-sent_at', '-message_id')[:50])
+                except OperationalError as exc:
+                    with lock:
+                        errors.append(str(exc))
+                    continue
+                with lock:
+                    reads.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(args.writers + args.readers) as pool:
+        futures = [pool.submit(writer, user) for user in users]
+        futures += [pool.submit(reader, i) for i in range(args.readers)]
+    for future in futures:
+        future.result()
+
+    reads.sort()
+    print(f'{label:<10} journal={journal:<8} writes {len(writes) / args.seconds:7.1f}/s  '
+          f'reads {len(reads) / args.seconds:8.1f}/s  read p99 {reads[int(len(reads) * 0.99) - 1] * 1000:7.2f} ms  '
+          f'write p50 {statistics.median(writes) * 1000:6.2f} ms  errors {len(errors)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f'{args.writers} writer and {args.readers} reader threads, {args.seconds:g}s per profile')
+    tuned = dict(connections['default'].settings_dict['OPTIONS'])
+    with tempfile.TemporaryDirectory() as directory:
+        run_profile('default', {}, args, directory)
+        run_profile('tuned', tuned, args, directory)
+
+
+if __name__ == '__main__':
+    main()
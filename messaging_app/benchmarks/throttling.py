@@ -0,0 +1,77 @@
+"""
+Per-request cost of the message-creation throttles: allow_request() for
+the per-user and per-conversation buckets, with the in-process and the
+Django-cache bucket stores, single-threaded and from several threads.
+
+Each user sends to a real conversation they belong to, in the throwaway
+test database. The membership check is warmed up first, as the
+permission check does it before throttling in a real request, so the
+timings cover the buckets and not the EXISTS query.
+
+    python benchmarks/throttling.py --requests 100000 --keys 1000 --threads 8
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from common import make_conversation, make_users, report, setup_database, timeit
+
+from django.test.utils import override_settings
+
+from chats.permissions import is_participant
+from chats.throttling import MessageConversationThrottle, MessageUserThrottle, get_token_bucket
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_database()
+    users = make_users(args.keys)
+    views = [
+        SimpleNamespace(kwargs={'conversation_pk': str(make_conversation([user], 0).pk)})
+        for user in users
+    ]
+    memos = []
+    for user, view in zip(users, views):
+        request = SimpleNamespace(user=user)
+        assert is_participant(request, view.kwargs['conversation_pk'])
+        memos.append(request._membership_memo)
+    print(f'{args.requests} requests over {args.keys} users/conversations, 2 throttles each')
+
+    for label, backend in [
+        ('LocalTokenBucket', 'chats.throttling.LocalTokenBucket'),
+        ('CacheTokenBucket (locmem)', 'chats.throttling.CacheTokenBucket'),
+    ]:
+        rates = {'message_user': '1000000/s', 'message_conversation': '1000000/s'}
+        with override_settings(CHATS_THROTTLE_ENABLED=True, CHATS_THROTTLE_BACKEND=backend,
+                               CHATS_THROTTLE_RATES=rates):
+            get_token_bucket.cache_clear()
+            throttles = [MessageUserThrottle(), MessageConversationThrottle()]
+
+            def run(start=0, count=args.requests):
+                for i in range(start, start + count):
+                    key = i % args.keys
+                    request = SimpleNamespace(user=users[key], _membership_memo=memos[key])
+                    view = views[key]
+                    for throttle in throttles:
+                        throttle.allow_request(request, view)
+
+            median, best = timeit(run)
+            report(label, median, best, f'{median / args.requests * 1e6:5.2f} us/request')
+
+            per_thread = args.requests // args.threads
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as pool:
+                list(pool.map(lambda t: run(t * per_thread, per_thread), range(args.threads)))
+            elapsed = time.perf_counter() - start
+            report(f'{label}, {args.threads} threads', elapsed, elapsed,
+                   f'{elapsed / (per_thread * args.threads) * 1e6:5.2f} us/request')
+
+
+if __name__ == '__main__':
+    main()
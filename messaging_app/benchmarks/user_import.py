@@ -0,0 +1,59 @@
+"""
+Bulk user import versus one create_user call per user.
+
+PBKDF2 cost dominates both paths at production settings, so it is set with
+--iterations (exported before Django starts, so the hashing workers see it
+too). The create_user baseline runs on a sample and is extrapolated.
+
+    python benchmarks/user_import.py --users 100000 --iterations 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--users', type=int, default=100000)
+parser.add_argument('--iterations', type=int, default=1000)
+parser.add_argument('--workers', type=int, nargs='+', default=[0, os.cpu_count() or 1])
+parser.add_argument('--baseline-sample', type=int, default=2000)
+args = parser.parse_args()
+os.environ['CHATS_PASSWORD_HASH_ITERATIONS'] = str(args.iterations)
+
+from common import setup_database  # noqa: E402  (boots Django with the setting above)
+
+from chats.models import CustomUser  # noqa: E402
+from chats.user_import import import_users  # noqa: E402
+
+
+def rows(prefix, count, with_passwords=True):
+    for i in range(count):
+        row = {'email': f'{prefix}{i}@example.com', 'first_name': 'Bulk', 'last_name': str(i), 'role': 'guest'}
+        if with_passwords:
+            row['password'] = f'password-{i}'
+        yield row
+
+
+def main():
+    setup_database()
+    print(f'{args.users} users, {args.iterations} PBKDF2 iterations', file=sys.stderr)
+
+    start = time.perf_counter()
+    for row in rows('baseline', args.baseline_sample):
+        CustomUser.objects.create_user(**row)
+    per_user = (time.perf_counter() - start) / args.baseline_sample
+    print(f'{"create_user loop (extrapolated)":<36} {per_user * args.users:8.1f} s  '
+          f'{1 / per_user:9.0f} users/s')
+
+    runs = [(f'import, {w} workers', w, True) for w in args.workers]
+    runs.append(('import, invitations only', 0, False))
+    for n, (label, workers, with_passwords) in enumerate(runs):
+        start = time.perf_counter()
+        result = import_users(rows(f'run{n}-', args.users, with_passwords), workers=workers)
+        elapsed = time.perf_counter() - start
+        assert result.created == args.users, result.errors[:3]
+        print(f'{label:<36} {elapsed:8.1f} s  {args.users / elapsed:9.0f} users/s')
+
+
+if __name__ == '__main__':
+    main()
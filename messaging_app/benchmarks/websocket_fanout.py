@@ -0,0 +1,70 @@
+"""
+Live update fan-out latency: connect many sockets to one conversation
+through the real ASGI handler, publish from a worker thread the way a sync
+view does, and time delivery to every socket.
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from common import make_conversation, make_users, setup_database
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.consumers import conversation_socket
+from chats.realtime import get_broadcaster
+
+
+async def open_socket(path, token):
+    incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+    scope = {'type': 'websocket', 'path': path, 'query_string': f'token={token}'.encode()}
+    task = asyncio.ensure_future(conversation_socket(scope, incoming.get, outgoing.put))
+    await incoming.put({'type': 'websocket.connect'})
+    assert (await outgoing.get())['type'] == 'websocket.accept'
+    return incoming, outgoing, task
+
+
+async def run(args, conversation, token):
+    path = f'/ws/conversations/{conversation.pk}/'
+    start = time.perf_counter()
+    sockets = [await open_socket(path, token) for _ in range(args.sockets)]
+    print(f'{args.sockets} sockets connected in {time.perf_counter() - start:.2f} s')
+
+    broadcaster = get_broadcaster()
+    latencies = []
+    for i in range(args.rounds):
+        published = time.perf_counter()
+        threading.Thread(target=broadcaster.publish, args=(conversation.pk, f'{{"seq": {i}}}')).start()
+        arrivals = []
+        for _, outgoing, _ in sockets:
+            await outgoing.get()
+            arrivals.append(time.perf_counter() - published)
+        latencies.append(arrivals)
+
+    last = [max(a) for a in latencies]
+    everyone = sorted(t for a in latencies for t in a)
+    print(f'median time to reach all sockets  {statistics.median(last) * 1000:8.2f} ms')
+    print(f'p50 per-socket delivery           {everyone[len(everyone) // 2] * 1000:8.2f} ms')
+    print(f'p99 per-socket delivery           {everyone[int(len(everyone) * 0.99)] * 1000:8.2f} ms')
+
+    for incoming, _, task in sockets:
+        await incoming.put({'type': 'websocket.disconnect'})
+    await asyncio.gather(*(task for _, _, task in sockets))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sockets', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_database()
+    owner, other = make_users(2)
+    conversation = make_conversation([owner, other], 0)
+    asyncio.run(run(args, conversation, AccessToken.for_user(other)))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals
+        post_migrate.connect(signals.install_search_index, sender=self)
@@ -0,0 +1,191 @@
+"""
+Hot/archive split of message storage.
+
+New messages live in the hot chats_message table. The archive_messages
+command moves messages older than CHATS_MESSAGE_ARCHIVE_AFTER_DAYS into
+chats_archivedmessage in batches, so the hot table, its indexes and the
+full-text index stay the size of recent traffic. Search only covers hot
+messages.
+
+Two kinds of message stay hot however old they are, because other rows
+point at them: each conversation's last message and every read position.
+When deleting the last message leaves an archived one as the newest,
+Conversation.refresh_last_message moves that one back.
+
+Reads that may reach into old history (message pages, detail lookups, sync
+and export) go through MessageHistory, which runs the same query against
+both tables and merges the results. Each side is a range scan on its own
+(conversation, sent_at, message_id) index, so paging back into archived
+ranges costs one extra indexed query per page rather than a scan.
+"""
+import heapq
+import itertools
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ArchivedMessage, Conversation, ConversationReadState, Message
+from .search import get_search_backend
+
+ARCHIVED_FIELDS = ['message_id', 'conversation_id', 'sender_id', 'message_body', 'sent_at']
+
+
+class MessageHistory:
+    """
+    Read-only queryset stand-in over hot and archived messages.
+
+    Supports what the views, cursor pagination and exports use: filter(),
+    order_by(), values(), select_related(), slicing, iterator() and get().
+    Results are merged on the ordering, which must be all ascending or all
+    descending. Rows are Message or ArchivedMessage instances (or dicts
+    after values()), which serialize the same way.
+    """
+    model = Message
+
+    def __init__(self, hot, archived, ordering=()):
+        self.hot = hot
+        self.archived = archived
+        self.ordering = tuple(ordering)
+
+    @classmethod
+    def filter_both(cls, *args, **kwargs):
+        return cls(Message.objects.filter(*args, **kwargs), ArchivedMessage.objects.filter(*args, **kwargs))
+
+    def _chain(self, method, *args, **kwargs):
+        return MessageHistory(
+            getattr(self.hot, method)(*args, **kwargs),
+            getattr(self.archived, method)(*args, **kwargs),
+            self.ordering,
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def select_related(self, *fields):
+        return self._chain('select_related', *fields)
+
+    def values(self, *fields):
+        return self._chain('values', *fields)
+
+    def order_by(self, *fields):
+        history = self._chain('order_by', *fields)
+        history.ordering = fields
+        return history
+
+    def none(self):
+        return self._chain('none')
+
+    @property
+    def ordered(self):
+        return bool(self.ordering)
+
+    def _sort(self):
+        """Return (key function, descending) for the ordering."""
+        descending = {field.startswith('-') for field in self.ordering}
+        if len(descending) != 1:
+            raise ValueError('MessageHistory ordering must be all ascending or all descending.')
+        names = [field.lstrip('-') for field in self.ordering]
+
+        def key(row):
+            if isinstance(row, dict):
+                return tuple(row[name] for name in names)
+            return tuple(getattr(row, name) for name in names)
+        return key, descending.pop()
+
+    def _merge(self, hot_rows, archived_rows):
+        if not self.ordering:
+            return itertools.chain(hot_rows, archived_rows)
+        key, descending = self._sort()
+        return heapq.merge(hot_rows, archived_rows, key=key, reverse=descending)
+
+    def _sorting_before(self, row):
+        """Q for rows that come before row in the ordering."""
+        key, descending = self._sort()
+        lookup = 'gt' if descending else 'lt'
+        names = [field.lstrip('-') for field in self.ordering]
+        values = key(row)
+        condition = Q()
+        for i, name in enumerate(names):
+            condition |= Q(**dict(zip(names[:i], values[:i])), **{f'{name}__{lookup}': values[i]})
+        # Redundant with the OR above, but lets the database seek the index
+        return Q(**{f'{names[0]}__{lookup}e': values[0]}) & condition
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or (k.step or 1) != 1:
+            raise TypeError('MessageHistory only supports contiguous slices.')
+        start, stop = k.start or 0, k.stop
+        if stop is None:
+            return list(self._merge(self.hot, self.archived))[start:]
+        # The first stop rows of the merge come from the first stop rows of
+        # each side. When the hot side fills them, archived rows can only
+        # get in ahead of its last row; usually there are none, and the
+        # archive query is an empty index probe
+        hot = list(self.hot[:stop])
+        archived = self.archived
+        if self.ordering and hot and len(hot) == stop:
+            archived = archived.filter(self._sorting_before(hot[-1]))
+        return list(self._merge(hot, archived[:stop]))[start:stop]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def iterator(self, chunk_size=None):
+        return self._merge(self.hot.iterator(chunk_size=chunk_size), self.archived.iterator(chunk_size=chunk_size))
+
+    def get(self, **kwargs):
+        try:
+            return self.hot.get(**kwargs)
+        except Message.DoesNotExist:
+            pass
+        try:
+            return self.archived.get(**kwargs)
+        except ArchivedMessage.DoesNotExist:
+            raise Message.DoesNotExist('Message matching query does not exist.') from None
+
+    async def aget(self, **kwargs):
+        return await sync_to_async(self.get)(**kwargs)
+
+
+def archivable_messages(before):
+    """Hot messages sent before the cutoff that nothing points at."""
+    return Message.objects.filter(sent_at__lt=before).exclude(
+        pk__in=Conversation.objects.filter(last_message__isnull=False).values('last_message_id')
+    ).exclude(
+        pk__in=ConversationReadState.objects.filter(last_read_message__isnull=False).values('last_read_message_id')
+    )
+
+
+def archive_batch(before, batch_size):
+    """Move up to batch_size of the oldest archivable messages; return how many moved."""
+    with transaction.atomic():
+        rows = list(archivable_messages(before).order_by('sent_at', 'message_id').values(
+            *ARCHIVED_FIELDS
+        )[:batch_size])
+        if not rows:
+            return 0
+        ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+        Message.objects.filter(pk__in=[row['message_id'] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_messages(before=None, batch_size=None):
+    """
+    Move every archivable message sent before the cutoff (default: older
+    than CHATS_MESSAGE_ARCHIVE_AFTER_DAYS) into the archive, one
+    transaction per batch so writers are never blocked for long, then
+    compacts the search index. Yields the running total after each batch.
+    """
+    if before is None:
+        before = timezone.now() - timedelta(days=settings.CHATS_MESSAGE_ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or settings.CHATS_MESSAGE_ARCHIVE_BATCH_SIZE
+    total = 0
+    while True:
+        moved = archive_batch(before, batch_size)
+        if not moved:
+            break
+        total += moved
+        yield total
+    if total:
+        get_search_backend().optimize(connection)
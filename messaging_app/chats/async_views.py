@@ -0,0 +1,195 @@
+"""
+ASGI-native read endpoints for conversations and messages.
+
+These mirror the list/retrieve actions of ConversationViewSet and
+MessageViewSet (same querysets, serializers and cursor pagination, so
+cursors are interchangeable) but are plain async Django views using the
+async ORM, so under an ASGI server a request waiting on the database does
+not pin a worker thread. DRF views are sync-only, hence the small JWT
+check here; it shares CachedJWTAuthentication's user cache.
+
+messages_since is async-only: its long-poll wait holds no thread at all.
+"""
+import asyncio
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.settings import api_settings
+from .archive import MessageHistory
+from .authentication import CachedJWTAuthentication, cached_user, check_user
+from .instrumentation import timed_serialization
+from .models import Conversation, CustomUser, Message
+from .pagination import MessageCursorPagination, decode_sync_cursor, encode_sync_cursor
+from .realtime import get_broadcaster
+from .routers import identify
+from .serializers import (
+    ConversationInboxSerializer,
+    ConversationSerializer,
+    MessageSerializer,
+    MessageSyncSerializer,
+)
+from .queries import conversation_history, user_conversation_details, user_conversations
+
+
+def render(data, status=200):
+    with timed_serialization():
+        content = JSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def async_read_view(view):
+    """Allow only GET/HEAD and authenticate the bearer token before calling view."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return render({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+
+        auth = CachedJWTAuthentication()
+        try:
+            header = auth.get_header(request)
+            raw_token = auth.get_raw_token(header) if header else None
+            if raw_token is None:
+                return render({'detail': 'Authentication credentials were not provided.'}, status=401)
+            token = auth.get_validated_token(raw_token)
+            user = cached_user(token)
+            if user is None:
+                user = check_user(
+                    await CustomUser.objects.aget(pk=token[api_settings.USER_ID_CLAIM]), token
+                )
+            request.user = user
+            identify(user.pk)
+        except APIException as exc:
+            return render(exc.detail, status=exc.status_code)
+        except (KeyError, CustomUser.DoesNotExist):
+            return render({'detail': 'User not found'}, status=401)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def is_member(user, conversation_id):
+    return await Conversation.participants.through.objects.filter(
+        conversation_id=conversation_id, customuser_id=user.pk
+    ).aexists()
+
+
+@async_read_view
+async def conversation_list(request):
+    conversations = [c async for c in user_conversations(request.user)]
+    return render(ConversationInboxSerializer(conversations, many=True).data)
+
+
+@async_read_view
+async def conversation_detail(request, pk):
+    try:
+        conversation = await user_conversation_details(request.user).aget(pk=pk)
+    except Conversation.DoesNotExist:
+        return render({'detail': 'Not found.'}, status=404)
+    return render(ConversationSerializer(conversation).data)
+
+
+@async_read_view
+async def message_list(request, conversation_pk):
+    if not await is_member(request.user, conversation_pk):
+        if not await Conversation.objects.filter(pk=conversation_pk).aexists():
+            return render({'detail': 'Not found.'}, status=404)
+        queryset = Message.objects.none()
+    else:
+        queryset = conversation_history(conversation_pk)
+
+    paginator = MessageCursorPagination()
+    drf_request = Request(request)
+    # The cursor paginator slices the queryset synchronously; run it off the
+    # event loop the same way the async ORM runs its queries
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, drf_request)
+    response = paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+    return render(response.data)
+
+
+@async_read_view
+async def message_detail(request, conversation_pk, pk):
+    if not await is_member(request.user, conversation_pk):
+        return render({'detail': 'Not found.'}, status=404)
+    try:
+        message = await conversation_history(conversation_pk).aget(pk=pk)
+    except Message.DoesNotExist:
+        return render({'detail': 'Not found.'}, status=404)
+    return render(MessageSerializer(message).data)
+
+
+def bounded_int(value, default, upper):
+    if value is None:
+        return default
+    return max(0, min(int(value), upper))
+
+
+@async_read_view
+async def messages_since(request):
+    """
+    Incremental sync across all of the caller's conversations.
+
+    Returns messages after the ``since`` cursor in (sent_at, message_id)
+    order, using a range query over the (conversation, sent_at, message_id)
+    index of hot and of archived messages. When there is nothing new and
+    ``timeout`` seconds are given, waits until a live update on any of the
+    conversations or the timeout, then queries again. Without ``since``, returns no messages and a cursor at
+    the newest message, so a client can start syncing from now.
+    """
+    try:
+        limit = bounded_int(request.GET.get('limit'), 100, settings.CHATS_SYNC_MAX_LIMIT) or 1
+        timeout = bounded_int(request.GET.get('timeout'), 0, settings.CHATS_LONG_POLL_MAX_TIMEOUT)
+        since = request.GET.get('since')
+        position = decode_sync_cursor(since) if since else None
+    except ValueError:
+        return render({'detail': 'Invalid since, limit or timeout.'}, status=400)
+
+    conversation_ids = [
+        cid async for cid in Conversation.participants.through.objects.filter(
+            customuser_id=request.user.pk
+        ).values_list('conversation_id', flat=True)
+    ]
+
+    if position is None:
+        # Every conversation's last message stays hot, so the newest message is too
+        latest = await Message.objects.filter(conversation_id__in=conversation_ids).order_by(
+            '-sent_at', '-message_id'
+        ).afirst()
+        return render({'results': [], 'cursor': encode_sync_cursor(latest) if latest else None,
+                       'has_more': False})
+
+    sent_at, message_id = position
+    # A client that was away long enough reads through to archived messages
+    newer = MessageHistory.filter_both(conversation_id__in=conversation_ids).filter(
+        Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id)
+    ).select_related('sender').order_by('sent_at', 'message_id')
+    fetch = sync_to_async(lambda: newer[:limit + 1])
+
+    # Subscribe before the first query so a message saved in between still
+    # wakes us up
+    broadcaster = get_broadcaster()
+    subscriptions = [broadcaster.subscribe(cid) for cid in conversation_ids] if timeout else []
+    try:
+        page = await fetch()
+        if not page and subscriptions:
+            waiters = [asyncio.ensure_future(s.get()) for s in subscriptions]
+            _, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in pending:
+                waiter.cancel()
+            # Query again on a timeout too: a write from another process
+            # without a shared broadcaster never wakes us
+            page = await fetch()
+    finally:
+        for subscription in subscriptions:
+            subscription.close()
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    return render({
+        'results': MessageSyncSerializer(page, many=True).data,
+        'cursor': encode_sync_cursor(page[-1]) if page else since,
+        'has_more': has_more,
+    })
@@ -1,26 +1,104 @@
+from datetime import datetime, timezone
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import (TokenObtainPairView,
 TokenRefreshView)
-from rest_framework import generics, status
+from django.conf import settings
+from rest_framework import generics, serializers, status
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
-from django.contrib.auth.models import User
-from rest_framework.permissions import AllowAny
-from rest_framework.serializers import ModelSerializer
+from rest_framework.views import APIView
+from .authentication import VERSION_CLAIM, add_user_claims
+from .models import CustomUser
+from .parsers import CSVParser, NDJSONParser
+from .revocation import get_revocation_store
+from .serializers import UserCreateSerializer
+from .throttling import AuthThrottle
+from .user_import import import_users
 
-class UserSerializer(ModelSerializer):
-    class Meta:
-        model = User
-        fields = ["id", "username", "email", "password"]
-        extra_kwargs = {"password": {"write_only": True}}
+class RegisterView(generics.CreateAPIView):
+    queryset = CustomUser.objects.all()
+    permission_classes = [AllowAny]
+    throttle_classes = [AuthThrottle]
+    serializer_class = UserCreateSerializer
 
-    def create(self, validated_data):
-        user = User.objects.create_user(**validated_data)
-        return user
+class UserImportView(APIView):
+    """
+    Create many users from a JSON array, NDJSON or CSV body (staff only).
+    Rows without a password become invitations; invalid rows are reported
+    by their index without aborting the rest.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [JSONParser, NDJSONParser, CSVParser]
 
-class RegisterView(generics.CreateAPIView):
-    queryset = User.objects.all()
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a list of users.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = settings.CHATS_USER_IMPORT_MAX_ROWS
+        if len(rows) > max_rows:
+            return Response({'detail': f'At most {max_rows} users per request.'}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_users(rows)
+        return Response(
+            {'created': result.created, 'errors': result.errors},
+            status=status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST,
+        )
+
+class LoginSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # Claims are copied from the refresh token to every access token it mints
+        return add_user_claims(super().get_token(user), user)
+
+def revoke(token):
+    """Revoke a refresh token until it expires; False if already revoked."""
+    expires_at = datetime.fromtimestamp(token['exp'], tz=timezone.utc)
+    return get_revocation_store().revoke(token[api_settings.JTI_CLAIM], expires_at)
+
+class RefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh against chats.revocation instead of SimpleJWT's blacklist app:
+    revoked tokens and tokens from before a user's revoke_tokens() are
+    rejected, and with rotation the old token is revoked before a new one
+    is issued, so each refresh token can be used once.
+    """
+    def validate(self, attrs):
+        try:
+            refresh = RefreshToken(attrs['refresh'])
+        except TokenError as exc:
+            raise InvalidToken(exc.args[0]) from exc
+        if get_revocation_store().is_revoked(refresh[api_settings.JTI_CLAIM]):
+            raise InvalidToken('Token is blacklisted')
+        user = CustomUser.objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM)).first()
+        if user is not None and refresh.get(VERSION_CLAIM, 0) != user.token_version:
+            raise InvalidToken('Token has been revoked')
+        if api_settings.ROTATE_REFRESH_TOKENS and api_settings.BLACKLIST_AFTER_ROTATION:
+            if not revoke(refresh):
+                raise InvalidToken('Token is blacklisted')
+        return super().validate(attrs)
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+class LogoutView(generics.GenericAPIView):
+    """Revoke a refresh token so it can no longer be exchanged."""
     permission_classes = [AllowAny]
-    serializer_class = UserSerializer
+    throttle_classes = [AuthThrottle]
+    serializer_class = LogoutSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            refresh = RefreshToken(serializer.validated_data['refresh'])
+        except TokenError as exc:
+            raise InvalidToken(exc.args[0]) from exc
+        revoke(refresh)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 # JWT login (built-in views)
-LoginView = TokenObtainPairView.as_view()
-RefreshView = TokenRefreshView.as_view()
+LoginView = TokenObtainPairView.as_view(serializer_class=LoginSerializer, throttle_classes=[AuthThrottle])
+RefreshView = TokenRefreshView.as_view(serializer_class=RefreshSerializer, throttle_classes=[AuthThrottle])
@@ -0,0 +1,108 @@
+"""
+JWT authentication that avoids a user query on every request.
+
+Access tokens carry the user's role and token version (see add_user_claims).
+Authenticated users are kept in a process-local LRU cache; a request is
+served from the cache when the token's version matches the cached user's,
+and loads the user from the database only on a miss, after the TTL, or when
+the token carries a different version. Revoking a user's tokens bumps
+CustomUser.token_version, which rejects every token issued before it.
+
+Saving a user drops it from this process's cache immediately (see
+chats.signals); other processes notice within CHATS_AUTH_USER_CACHE_TTL.
+Once the user is known the request is identified to chats.routers, which
+keeps users who just wrote on the primary database.
+"""
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from .routers import identify
+
+ROLE_CLAIM = 'role'
+VERSION_CLAIM = 'tv'
+
+
+def add_user_claims(token, user):
+    token[ROLE_CLAIM] = user.role
+    token[VERSION_CLAIM] = user.token_version
+    return token
+
+
+class UserCache:
+    """Thread-safe LRU of users keyed by user id, with a TTL per entry."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def set(self, user):
+        if self.maxsize <= 0:
+            return
+        user_id = str(user.pk)
+        with self._lock:
+            self._users[user_id] = (copy.copy(user), time.monotonic() + self.ttl)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+@functools.lru_cache(maxsize=None)
+def get_user_cache():
+    return UserCache(settings.CHATS_AUTH_USER_CACHE_SIZE, settings.CHATS_AUTH_USER_CACHE_TTL)
+
+
+def cached_user(token):
+    """Return the cached user for a validated token, or None to load it."""
+    user = get_user_cache().get(str(token[api_settings.USER_ID_CLAIM]))
+    if user is None or user.token_version != token.get(VERSION_CLAIM, 0):
+        return None
+    # Each request gets its own copy so nothing leaks between requests
+    return copy.copy(user)
+
+
+def check_user(user, token):
+    """Reject inactive users and revoked tokens, then cache the user."""
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    # Tokens issued before versions existed carry no claim and count as 0
+    if token.get(VERSION_CLAIM, 0) != user.token_version:
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+    get_user_cache().set(user)
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user = cached_user(validated_token)
+        if user is None:
+            user = check_user(super().get_user(validated_token), validated_token)
+        identify(user.pk)
+        return user
@@ -0,0 +1,39 @@
+"""
+SQLite backend with a production profile, configured through OPTIONS:
+
+- ``pragmas``: PRAGMAs run on every new connection, e.g. WAL journaling so
+  readers are not blocked by a writer.
+- ``transaction_mode``: how atomic() opens transactions. IMMEDIATE takes
+  the write lock up front, so a transaction that reads and then writes
+  waits out busy_timeout instead of failing at once with "database is
+  locked" when another write is in flight.
+
+Every other option is passed to sqlite3.connect() as usual. The names
+follow the options Django 5.1 added to its own backend.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        self.cursor().execute(f'BEGIN {mode.upper()}')
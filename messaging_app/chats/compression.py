@@ -0,0 +1,92 @@
+"""
+Transparent compression of large message bodies.
+
+CompressedTextField stores text longer than CHATS_MESSAGE_COMPRESSION_THRESHOLD
+bytes (UTF-8) as a BLOB: one codec marker byte followed by the compressed
+text. Shorter bodies, and bodies that do not shrink, stay plain text, so a
+column holds both kinds. Values are kept compressed as loaded and only
+decompressed the first time the attribute is read, e.g. when
+MessageSerializer renders the body; values() rows carry the raw value and
+are decoded by message_rows() with decode_body().
+
+zstd is used when the zstandard package is installed and configured,
+zlib otherwise; every codec that was ever configured must stay readable,
+so codecs are only ever added. Only SQLite stores compressed values:
+PostgreSQL already compresses large text itself (TOAST), and its text
+columns cannot hold bytes.
+
+chats.signals registers decode_body as the SQL function chats_body_text()
+on every SQLite connection, whatever the engine; the full-text search
+triggers use it to index the text rather than the BLOB.
+"""
+import zlib
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional codec
+    zstandard = None
+
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+
+DECOMPRESSORS = {ZLIB: zlib.decompress}
+if zstandard is not None:
+    DECOMPRESSORS[ZSTD] = lambda data: zstandard.ZstdDecompressor().decompress(data)
+
+
+def compress_body(text):
+    """Return text as stored: unchanged, or a marker-prefixed compressed BLOB."""
+    raw = text.encode()
+    if len(raw) < settings.CHATS_MESSAGE_COMPRESSION_THRESHOLD:
+        return text
+    if settings.CHATS_MESSAGE_COMPRESSION_CODEC == 'zstd' and zstandard is not None:
+        data = ZSTD + zstandard.ZstdCompressor(level=settings.CHATS_MESSAGE_COMPRESSION_LEVEL).compress(raw)
+    else:
+        data = ZLIB + zlib.compress(raw, settings.CHATS_MESSAGE_COMPRESSION_LEVEL)
+    return data if len(data) < len(raw) else text
+
+
+def decode_body(value):
+    """Return the text for a stored value, compressed or not."""
+    if not isinstance(value, (bytes, memoryview)):
+        return value
+    value = bytes(value)
+    try:
+        decompress = DECOMPRESSORS[value[:1]]
+    except KeyError:
+        raise ValueError(f'Unknown message body codec {value[:1]!r}') from None
+    return decompress(value[1:]).decode()
+
+
+class CompressedTextAttribute(DeferredAttribute):
+    """Decompress on first access and keep the text on the instance."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = instance.__dict__[self.field.attname] = decode_body(value)
+        return value
+
+    # Defining __set__ makes this a data descriptor, so reads go through
+    # __get__ even though the value lives in the instance __dict__
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    descriptor_class = CompressedTextAttribute
+
+    def to_python(self, value):
+        return super().to_python(decode_body(value))
+
+    def get_db_prep_save(self, value, connection):
+        if connection.vendor != 'sqlite':
+            return super().get_db_prep_save(decode_body(value), connection)
+        # Values loaded compressed and never read are saved back as they are
+        if isinstance(value, (bytes, memoryview)):
+            return bytes(value)
+        value = super().get_db_prep_save(value, connection)
+        return compress_body(value) if isinstance(value, str) else value
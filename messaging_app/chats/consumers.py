@@ -0,0 +1,101 @@
+"""
+ASGI WebSocket handler for live conversation updates.
+
+Clients connect to ``/ws/conversations/<conversation_id>/?token=<access>``
+with a SimpleJWT access token and receive a JSON text frame for every
+message created in that conversation. Frames sent by the client are ignored.
+The token is checked like CachedJWTAuthentication does (inactive users and
+revoked tokens are refused), and the socket is closed when its user is
+removed from the conversation.
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import cached_user, check_user
+from .models import Conversation, CustomUser
+from .realtime import PARTICIPANTS_REMOVED_PREFIX, get_broadcaster
+
+PATH_RE = re.compile(r'^/ws/conversations/(?P<conversation_id>[0-9a-f-]{36})/?$')
+
+# Close codes in the application range (4000-4999), mirroring HTTP statuses
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+
+
+async def get_token_user(scope):
+    """Authenticate the access token from the query string, return its user."""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    raw_token = query.get('token', [None])[0]
+    if not raw_token:
+        return None
+    try:
+        token = AccessToken(raw_token)
+        user = cached_user(token)
+        if user is None:
+            user = check_user(await CustomUser.objects.aget(pk=token[api_settings.USER_ID_CLAIM]), token)
+    except (TokenError, AuthenticationFailed, KeyError, CustomUser.DoesNotExist):
+        return None
+    return user
+
+
+@sync_to_async
+def is_active_participant(user_id, conversation_id):
+    return Conversation.participants.through.objects.filter(
+        conversation_id=conversation_id,
+        customuser_id=user_id,
+        customuser__is_active=True,
+    ).exists()
+
+
+async def conversation_socket(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = PATH_RE.match(scope['path'])
+    if not match:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    conversation_id = match['conversation_id']
+
+    user = await get_token_user(scope)
+    if user is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+    user_id = str(user.pk)
+    if not await is_active_participant(user_id, conversation_id):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    subscription = get_broadcaster().subscribe(conversation_id)
+    await send({'type': 'websocket.accept'})
+
+    receiving = asyncio.ensure_future(receive())
+    getting = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiving, getting}, return_when=asyncio.FIRST_COMPLETED)
+            if getting in done:
+                payload = getting.result()
+                if payload.startswith(PARTICIPANTS_REMOVED_PREFIX):
+                    if user_id in json.loads(payload)['user_ids']:
+                        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+                        break
+                else:
+                    await send({'type': 'websocket.send', 'text': payload})
+                getting = asyncio.ensure_future(subscription.get())
+            if receiving in done:
+                if receiving.result()['type'] == 'websocket.disconnect':
+                    break
+                receiving = asyncio.ensure_future(receive())
+    finally:
+        receiving.cancel()
+        getting.cancel()
+        subscription.close()
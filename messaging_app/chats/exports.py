@@ -0,0 +1,53 @@
+"""
+Streaming conversation exports.
+
+Messages, archived ones included, are read with chunked iterators (no
+result cache) and encoded a chunk at a time, so memory stays flat however
+long the history is.
+"""
+import csv
+from django.conf import settings
+from .renderers import FastJSONRenderer
+from .serializers import message_rows, message_values
+from .queries import conversation_history
+
+CSV_HEADER = ['message_id', 'sent_at', 'sender_id', 'sender_email', 'message_body']
+
+
+def iter_row_chunks(conversation_id):
+    chunk_size = settings.CHATS_EXPORT_CHUNK_SIZE
+    rows = message_values(conversation_history(conversation_id)).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield message_rows(chunk)
+            chunk = []
+    if chunk:
+        yield message_rows(chunk)
+
+
+def ndjson_stream(conversation_id):
+    render = FastJSONRenderer().render
+    for chunk in iter_row_chunks(conversation_id):
+        yield b''.join(render(row) + b'\n' for row in chunk)
+
+
+class _Echo:
+    """File-like object whose write() hands back the line csv.writer built."""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(conversation_id):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for chunk in iter_row_chunks(conversation_id):
+        yield ''.join(
+            writer.writerow([
+                row['message_id'], row['sent_at'], row['sender']['user_id'],
+                row['sender']['email'], row['message_body'],
+            ])
+            for row in chunk
+        )
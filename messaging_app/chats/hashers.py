@@ -0,0 +1,63 @@
+"""
+PBKDF2 password hashing with a configurable cost, run on a bounded pool.
+
+Every hash Django computes (registration, login, rehash) goes through
+PooledPBKDF2PasswordHasher.encode, which runs PBKDF2 on a pool of
+CHATS_PASSWORD_HASH_WORKERS threads. hashlib releases the GIL while
+hashing, so the pool caps how many cores a burst of signups and logins can
+take from other requests; callers beyond the pool wait in line, and once
+CHATS_PASSWORD_HASH_QUEUE are waiting further calls fail fast with a 503
+instead of piling up. CHATS_PASSWORD_HASH_WORKERS = 0 hashes inline.
+
+The iteration count comes from CHATS_PASSWORD_HASH_ITERATIONS. Stored
+hashes with a different count are rewritten on the user's next successful
+login (Django's must_update), so the cost can be changed at any time.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = 503
+    default_detail = 'Too many sign-ins in progress, try again shortly.'
+    default_code = 'password_hashing_busy'
+
+
+class HashingPool:
+    def __init__(self, workers, queue_size):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+
+@functools.lru_cache(maxsize=None)
+def get_hashing_pool():
+    workers = settings.CHATS_PASSWORD_HASH_WORKERS
+    if not workers:
+        return None
+    return HashingPool(workers, settings.CHATS_PASSWORD_HASH_QUEUE)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Same algorithm name, so existing pbkdf2_sha256 hashes verify unchanged
+
+    @property
+    def iterations(self):
+        return settings.CHATS_PASSWORD_HASH_ITERATIONS
+
+    def encode(self, password, salt, iterations=None):
+        pool = get_hashing_pool()
+        if pool is None:
+            return super().encode(password, salt, iterations)
+        return pool.run(super().encode, password, salt, iterations)
@@ -0,0 +1,198 @@
+"""
+Per-endpoint request instrumentation.
+
+InstrumentationMiddleware (chats.middleware) samples
+CHATS_INSTRUMENTATION_SAMPLE_RATE of requests. For a sampled request it
+records, per endpoint (URL name) and method:
+
+- request duration,
+- SQL statement count and time, from an execute wrapper installed on every
+  database connection (see chats.signals),
+- serialization time: building representations (serializers using
+  TimedRepresentationMixin, message_rows) plus JSON encoding, and
+- response size.
+
+Unsampled requests are only counted; the execute wrapper and timers check
+one context variable and do nothing else for them. Histograms live in this
+process (registry) and are served in the Prometheus text format by
+/api/metrics/, together with the throttle counters. With
+CHATS_SERVER_TIMING, sampled responses also carry a Server-Timing header.
+"""
+import bisect
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from collections import defaultdict
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(9))  # 256 B to 16 MiB
+
+_stats = contextvars.ContextVar('chats_request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'serialization_time', '_serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self._serializing = False
+
+
+@contextlib.contextmanager
+def measure_request():
+    """Collect stats for the code run inside the block."""
+    stats = RequestStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting statements and their time for the sampled request."""
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+@contextlib.contextmanager
+def timed_serialization():
+    """Count the block as serialization time, unless nested in another one."""
+    stats = _stats.get()
+    if stats is None or stats._serializing:
+        yield
+        return
+    stats._serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialization_time += time.perf_counter() - start
+        stats._serializing = False
+
+
+class TimedRepresentationMixin:
+    """Serializer mixin that times to_representation for the sampled request."""
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the shape Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+class MetricsRegistry:
+    """Request counters and histograms keyed by (endpoint, method)."""
+
+    histograms = {
+        'chats_http_request_duration_seconds': ('Request duration of sampled requests.', DURATION_BUCKETS),
+        'chats_db_queries': ('SQL statements per sampled request.', QUERY_BUCKETS),
+        'chats_db_duration_seconds': ('Time in SQL statements per sampled request.', DURATION_BUCKETS),
+        'chats_serialization_duration_seconds': (
+            'Time building and encoding representations per sampled request.', DURATION_BUCKETS
+        ),
+        'chats_response_size_bytes': ('Response body size of sampled requests.', SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(int)
+            self._histograms = {name: {} for name in self.histograms}
+
+    def count(self, labels):
+        with self._lock:
+            self._requests[labels] += 1
+
+    def observe(self, labels, duration, stats, size):
+        values = {
+            'chats_http_request_duration_seconds': duration,
+            'chats_db_queries': stats.queries,
+            'chats_db_duration_seconds': stats.db_time,
+            'chats_serialization_duration_seconds': stats.serialization_time,
+        }
+        if size is not None:
+            values['chats_response_size_bytes'] = size
+        with self._lock:
+            for name, value in values.items():
+                histogram = self._histograms[name].get(labels)
+                if histogram is None:
+                    histogram = self._histograms[name][labels] = Histogram(self.histograms[name][1])
+                histogram.observe(value)
+
+    def render(self, extra=()):
+        """Prometheus text exposition of everything recorded, plus extra lines."""
+        lines = [
+            '# HELP chats_http_requests_total Requests seen, sampled or not.',
+            '# TYPE chats_http_requests_total counter',
+        ]
+        with self._lock:
+            for labels, value in sorted(self._requests.items()):
+                lines.append(f'chats_http_requests_total{{{format_labels(labels)}}} {value}')
+            for name, (help_text, buckets) in self.histograms.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    label_text = format_labels(labels)
+                    cumulative = 0
+                    for bound, count in zip((*buckets, math.inf), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else format_number(bound)
+                        lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label_text}}} {format_number(histogram.sum)}')
+                    lines.append(f'{name}_count{{{label_text}}} {cumulative}')
+        lines += extra
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    endpoint, method = labels
+    return f'endpoint="{escape(endpoint)}",method="{escape(method)}"'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def server_timing(duration, stats):
+    return (
+        f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+        f'ser;dur={stats.serialization_time * 1000:.2f}, '
+        f'total;dur={duration * 1000:.2f}'
+    )
+
+
+registry = MetricsRegistry()
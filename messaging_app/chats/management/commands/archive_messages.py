@@ -0,0 +1,32 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chats.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Move old messages from the hot messages table into the archive. "
+        "Archived messages are still listed, exported and synced; search covers hot messages only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='DAYS',
+                            help=f"Archive messages older than this (default {settings.CHATS_MESSAGE_ARCHIVE_AFTER_DAYS})")
+        parser.add_argument('--batch-size', type=int, help="Messages moved per transaction")
+
+    def handle(self, older_than=None, batch_size=None, **options):
+        days = settings.CHATS_MESSAGE_ARCHIVE_AFTER_DAYS if older_than is None else older_than
+        before = timezone.now() - timedelta(days=days)
+
+        start = time.perf_counter()
+        moved = 0
+        for moved in archive_messages(before, batch_size):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{moved} messages archived")
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} messages sent before {before:%Y-%m-%d %H:%M} in {elapsed:.1f}s"
+        ))
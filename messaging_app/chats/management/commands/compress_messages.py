@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.functions import Length
+from chats.compression import compress_body
+from chats.models import ArchivedMessage, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Compress stored message bodies, hot and archived, that are over "
+        "CHATS_MESSAGE_COMPRESSION_THRESHOLD; new messages are compressed as they are saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows read and rewritten per transaction")
+
+    def handle(self, batch_size, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write("Only SQLite stores compressed bodies; nothing to do.")
+            return
+        for model in (Message, ArchivedMessage):
+            compressed = self.compress(model, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Compressed {compressed} {model._meta.verbose_name_plural}"))
+
+    def compress(self, model, batch_size):
+        # A UTF-8 character is at most 4 bytes, so shorter rows cannot qualify
+        candidates = model.objects.annotate(body_length=Length('message_body')).filter(
+            body_length__gte=settings.CHATS_MESSAGE_COMPRESSION_THRESHOLD // 4
+        ).order_by('pk')
+        compressed, last = 0, None
+        while True:
+            batch = candidates if last is None else candidates.filter(pk__gt=last)
+            # values_list() gives bodies as stored: bytes are already compressed
+            rows = list(batch.values_list('pk', 'message_body')[:batch_size])
+            if not rows:
+                return compressed
+            last = rows[-1][0]
+            with transaction.atomic():
+                for pk, body in rows:
+                    stored = compress_body(body) if isinstance(body, str) else body
+                    if stored is not body:
+                        model.objects.filter(pk=pk).update(message_body=stored)
+                        compressed += 1
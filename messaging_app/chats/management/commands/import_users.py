@@ -0,0 +1,40 @@
+import sys
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from chats.user_import import FORMATS, import_users, parse_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users in bulk from a CSV (with a header row) or NDJSON file. "
+        "Rows without a password are created as invitations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, help="Rows validated and inserted at a time")
+        parser.add_argument('--workers', type=int, help="Password hashing processes (0 hashes in-process)")
+
+    def handle(self, path, format=None, batch_size=None, workers=None, **options):
+        fmt = format or Path(path).suffix.lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format {' or '.join(FORMATS)}")
+
+        start = time.perf_counter()
+        if path == '-':
+            result = import_users(parse_rows(sys.stdin, fmt), batch_size, workers)
+        else:
+            try:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    result = import_users(parse_rows(stream, fmt), batch_size, workers)
+            except OSError as exc:
+                raise CommandError(exc)
+        elapsed = time.perf_counter() - start
+
+        for error in result.errors:
+            self.stderr.write(f"row {error['index']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result.created} users in {elapsed:.1f}s ({len(result.errors)} rows rejected)"
+        ))
@@ -0,0 +1,98 @@
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .instrumentation import measure_request, registry, server_timing
+from .routers import record_write, routing_state
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE', 'TRACE', 'CONNECT'))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Give each request its own chats.routers state: unsafe methods use the
+    primary throughout, and a request that wrote keeps its user on the
+    primary for the read-your-writes window.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing_state(primary=request.method not in SAFE_METHODS) as state:
+            response = self.get_response(request)
+            record_write(state)
+        return response
+
+    async def __acall__(self, request):
+        with routing_state(primary=request.method not in SAFE_METHODS) as state:
+            response = await self.get_response(request)
+            record_write(state)
+        return response
+
+
+class InstrumentationMiddleware:
+    """
+    Count every request per endpoint and, for a CHATS_INSTRUMENTATION_SAMPLE_RATE
+    share of them, record duration, queries, DB and serialization time and
+    response size in chats.instrumentation.registry. Goes first in
+    MIDDLEWARE so the duration covers the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            response = self.get_response(request)
+            registry.count(self.labels(request))
+            return response
+        start = time.perf_counter()
+        with measure_request() as stats:
+            response = self.get_response(request)
+        return self.observe(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            response = await self.get_response(request)
+            registry.count(self.labels(request))
+            return response
+        start = time.perf_counter()
+        with measure_request() as stats:
+            response = await self.get_response(request)
+        return self.observe(request, response, stats, time.perf_counter() - start)
+
+    @staticmethod
+    def sampled():
+        rate = settings.CHATS_INSTRUMENTATION_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    @staticmethod
+    def labels(request):
+        # The URL name rather than the path, so ids do not multiply series;
+        # likewise any non-standard method is one OTHER series
+        match = getattr(request, 'resolver_match', None)
+        method = request.method if request.method in HTTP_METHODS else 'OTHER'
+        return (match.view_name if match else 'unmatched'), method
+
+    def observe(self, request, response, stats, duration):
+        labels = self.labels(request)
+        registry.count(labels)
+        size = None if response.streaming else len(response.content)
+        registry.observe(labels, duration, stats, size)
+        if settings.CHATS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(duration, stats)
+        return response
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_last_message(apps, schema_editor):
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    for conversation in Conversation.objects.iterator():
+        messages = Message.objects.filter(conversation=conversation)
+        last_msg = messages.order_by('-sent_at', '-message_id').first()
+        if last_msg is None:
+            continue
+        conversation.last_message = last_msg
+        conversation.last_message_sender_id = last_msg.sender_id
+        conversation.last_message_preview = last_msg.message_body[:100]
+        conversation.last_message_at = last_msg.sent_at
+        conversation.message_count = messages.count()
+        conversation.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_message_conv_sent_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
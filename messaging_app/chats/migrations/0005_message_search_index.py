@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from chats.search import get_search_backend
+    get_search_backend().install(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('chats_message_fts_ai', 'chats_message_fts_ad', 'chats_message_fts_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute('DROP TABLE IF EXISTS chats_message_fts')
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS chats_message_body_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversation_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_read_states(apps, schema_editor):
+    # Existing participants start caught up rather than with every old
+    # message unread
+    Conversation = apps.get_model('chats', 'Conversation')
+    ConversationReadState = apps.get_model('chats', 'ConversationReadState')
+    Participant = Conversation.participants.through
+    positions = {
+        pk: (message_id, sent_at)
+        for pk, message_id, sent_at in Conversation.objects.values_list('pk', 'last_message_id', 'last_message_at')
+    }
+    ConversationReadState.objects.bulk_create(
+        (
+            ConversationReadState(
+                conversation_id=row.conversation_id,
+                user_id=row.customuser_id,
+                last_read_message_id=positions[row.conversation_id][0],
+                last_read_at=positions[row.conversation_id][1],
+            )
+            for row in Participant.objects.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='chats.conversation')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='conversationreadstate',
+            constraint=models.UniqueConstraint(fields=('user', 'conversation'), name='read_state_user_conv_uniq'),
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:21
+
+import hashlib
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def backfill_participant_keys(apps, schema_editor):
+    # The oldest conversation for each participant set becomes canonical;
+    # later duplicates stay keyless
+    Conversation = apps.get_model('chats', 'Conversation')
+    Participant = Conversation.participants.through
+    members = defaultdict(list)
+    for conversation_id, user_id in Participant.objects.values_list('conversation_id', 'customuser_id').iterator():
+        members[conversation_id].append(str(user_id))
+    claimed = set()
+    for conversation in Conversation.objects.order_by('created_at').only('pk').iterator():
+        user_ids = members.get(conversation.pk)
+        if not user_ids:
+            continue
+        key = hashlib.sha256(','.join(sorted(set(user_ids))).encode()).hexdigest()
+        if key in claimed:
+            continue
+        claimed.add(key)
+        Conversation.objects.filter(pk=conversation.pk).update(participant_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_revoked_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_participant_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:54
+
+import chats.compression
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    # The triggers now index chats_body_text(message_body)
+    from chats.search import get_search_backend
+    get_search_backend().install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_archived_message'),
+    ]
+
+    operations = [
+        # Same column type: only Django's state changes. A database
+        # AlterField would make SQLite copy the whole messages table
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='archivedmessage',
+                    name='message_body',
+                    field=chats.compression.CompressedTextField(),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='message_body',
+                    field=chats.compression.CompressedTextField(),
+                ),
+            ],
+        ),
+        migrations.RunPython(install_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations
+
+# Frozen copies of the chats.search index and triggers that index the
+# text of compressed bodies through chats_body_text(), which chats.signals
+# registers on every SQLite connection. 0005 and 0011 ran the search
+# backend's install() as it was then; from here on the SQL is frozen
+TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chats_message_fts USING fts5("
+    "message_body, content='chats_message', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+
+TRIGGERS = [
+    """
+            CREATE TRIGGER chats_message_fts_ai AFTER INSERT ON chats_message BEGIN
+                INSERT INTO chats_message_fts(rowid, message_body)
+                VALUES (new.rowid, chats_body_text(new.message_body));
+            END""",
+    """
+            CREATE TRIGGER chats_message_fts_ad AFTER DELETE ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, chats_body_text(old.message_body));
+            END""",
+    """
+            CREATE TRIGGER chats_message_fts_au AFTER UPDATE OF message_body ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, chats_body_text(old.message_body));
+                INSERT INTO chats_message_fts(rowid, message_body)
+                VALUES (new.rowid, chats_body_text(new.message_body));
+            END""",
+]
+
+# The 0005 triggers, restored when migrating backwards
+PLAIN_TRIGGERS = [
+    """
+            CREATE TRIGGER chats_message_fts_ai AFTER INSERT ON chats_message BEGIN
+                INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body);
+            END""",
+    """
+            CREATE TRIGGER chats_message_fts_ad AFTER DELETE ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, old.message_body);
+            END""",
+    """
+            CREATE TRIGGER chats_message_fts_au AFTER UPDATE OF message_body ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, old.message_body);
+                INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body);
+            END""",
+]
+
+
+def replace_triggers(triggers):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute(TABLE)
+        for name in ('chats_message_fts_ai', 'chats_message_fts_ad', 'chats_message_fts_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        for sql in triggers:
+            schema_editor.execute(sql)
+        # Reindex the text: FTS5's own rebuild would index compressed
+        # bodies as they are stored
+        schema_editor.execute("INSERT INTO chats_message_fts(chats_message_fts) VALUES ('delete-all')")
+        schema_editor.execute(
+            "INSERT INTO chats_message_fts(rowid, message_body) "
+            "SELECT rowid, chats_body_text(message_body) FROM chats_message"
+        )
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0011_compressed_message_body'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_triggers(TRIGGERS), replace_triggers(PLAIN_TRIGGERS)),
+    ]
@@ -0,0 +1,39 @@
+import hashlib
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """Strong ETag over the repr of a version stamp."""
+    return '"%s"' % hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for list/retrieve actions.
+
+    Views implement get_etag() from a cheap version stamp (no serialization,
+    at most a narrow query). When it matches If-None-Match the view answers
+    304 without running the action; otherwise the ETag is set on the 200.
+    """
+
+    def get_etag(self, request):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None:
+            if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+            if etag in if_none_match or '*' in if_none_match:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
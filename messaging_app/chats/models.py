@@ -1,6 +1,12 @@
+import hashlib
 import uuid
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from .compression import CompressedTextField
+
+# Length of the message body preview kept on Conversation
+PREVIEW_LENGTH = 100
 
 # Custom User Manager
 class CustomUserManager(BaseUserManager):
@@ -36,6 +42,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Embedded in access tokens; bumping it revokes every token issued so far
+    token_version = models.PositiveIntegerField(default=0)
 
     objects = CustomUserManager()
 
@@ -45,20 +53,237 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return f"{self.email}"
 
+    def revoke_tokens(self):
+        """Invalidate every access token issued to this user so far."""
+        self.token_version = F('token_version') + 1
+        self.save(update_fields=['token_version'])
+        self.refresh_from_db(fields=['token_version'])
+
 class Conversation(models.Model):
     conversation_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     participants = models.ManyToManyField(CustomUser, related_name='conversations')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized summary of the latest message, kept current by
+    # record_message/refresh_last_message so inbox listings never have to
+    # look up messages per conversation
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_message_sender = models.ForeignKey(
+        CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # Bumped whenever the conversation, its participants or its messages
+    # change; cheap version stamp for ETags
+    version = models.PositiveIntegerField(default=0)
+    # Fingerprint of the participant set for conversations that are the
+    # canonical one for that set (see get_or_create_for); cleared when the
+    # participants change
+    participant_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+
+    @staticmethod
+    def participant_key_for(user_ids):
+        canonical = ','.join(sorted(str(uuid.UUID(str(user_id))) for user_id in set(user_ids)))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @classmethod
+    def get_or_create_for(cls, user_ids):
+        """
+        Return (conversation, created) for exactly these participants,
+        reusing the canonical conversation for the set when there is one.
+        The lookup is a single query on the participant_key unique index.
+        """
+        key = cls.participant_key_for(user_ids)
+        conversation = cls.objects.filter(participant_key=key).first()
+        if conversation is not None:
+            return conversation, False
+        try:
+            with transaction.atomic():
+                conversation = cls.objects.create()
+                # One bulk insert into the through table
+                conversation.participants.add(*user_ids)
+                # Claimed last: adding participants clears the key
+                conversation.participant_key = key
+                conversation.save(update_fields=['participant_key'])
+        except IntegrityError:
+            # Another request created it first
+            return cls.objects.get(participant_key=key), False
+        return conversation, True
+
     def __str__(self):
         return f"Conversation {self.conversation_id}"
 
+    def bump_version(self):
+        Conversation.objects.filter(pk=self.pk).update(version=F('version') + 1)
+
+    def record_message(self, message, count=1):
+        """
+        Point the summary at a newly saved message and bump the count by
+        the number of messages saved (more than one for bulk inserts).
+        Call inside the transaction that saved the message.
+        """
+        conversation = Conversation.objects.filter(pk=self.pk)
+        conversation.update(message_count=F('message_count') + count, version=F('version') + 1)
+        # Concurrent sends can commit out of order; never move the summary
+        # back to an older message
+        conversation.filter(Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.sent_at)).update(
+            last_message=message,
+            last_message_sender_id=message.sender_id,
+            last_message_preview=message.message_body[:PREVIEW_LENGTH],
+            last_message_at=message.sent_at,
+        )
+        # Everyone else has more to read; the sender has read up to here
+        states = ConversationReadState.objects.filter(conversation_id=self.pk)
+        states.exclude(user_id=message.sender_id).update(unread_count=F('unread_count') + count)
+        states.filter(user_id=message.sender_id).update(
+            last_read_message=message, last_read_at=message.sent_at, unread_count=0,
+        )
+
+    def refresh_last_message(self):
+        """
+        Recompute the summary from the messages table, e.g. after the
+        latest message was edited or a message was deleted. When the
+        latest remaining message is archived it is moved back to the hot
+        table, which last_message points into.
+        """
+        last_msg = self.messages.order_by('-sent_at', '-message_id').first()
+        last_archived = self.archived_messages.order_by('-sent_at', '-message_id').first()
+        if last_archived is not None and (
+            last_msg is None
+            or (last_archived.sent_at, last_archived.message_id) > (last_msg.sent_at, last_msg.message_id)
+        ):
+            last_msg = last_archived.restore()
+        Conversation.objects.filter(pk=self.pk).update(
+            last_message=last_msg,
+            last_message_sender_id=last_msg.sender_id if last_msg else None,
+            last_message_preview=last_msg.message_body[:PREVIEW_LENGTH] if last_msg else '',
+            last_message_at=last_msg.sent_at if last_msg else None,
+            message_count=self.messages.count() + self.archived_messages.count(),
+            version=F('version') + 1,
+        )
+
 class Message(models.Model):
     message_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='sent_messages')
-    message_body = models.TextField()
+    message_body = CompressedTextField()
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='message_conv_sent_idx'),
+        ]
+
     def __str__(self):
         return f"Message {self.message_id} from {self.sender.email}"
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of the hot messages table by the archive_messages
+    command (see chats.archive). Same columns as Message, so the two read
+    alike; MessageHistory reads both.
+    """
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    # Covered by the index below, which starts with conversation
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='archived_messages', db_index=False
+    )
+    sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    message_body = CompressedTextField()
+    sent_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='archived_conv_sent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.message_id}"
+
+    def restore(self):
+        """Move this message back into the hot table and return it."""
+        with transaction.atomic():
+            message = Message.objects.create(
+                message_id=self.message_id,
+                conversation_id=self.conversation_id,
+                sender_id=self.sender_id,
+                message_body=self.message_body,
+            )
+            # sent_at is auto_now_add on Message; keep the original time
+            Message.objects.filter(pk=message.pk).update(sent_at=self.sent_at)
+            message.sent_at = self.sent_at
+            self.delete()
+        return message
+
+class ConversationReadState(models.Model):
+    """
+    How far a participant has read a conversation, with the number of
+    messages from others after that point kept incrementally so inbox
+    badges never need a COUNT.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='read_states')
+    last_read_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='read_state_user_conv_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} read {self.conversation_id} up to {self.last_read_at}"
+
+    def unread_messages(self, model=None):
+        """Messages (or archived messages) from others after the read position."""
+        messages = (model or Message).objects.filter(conversation_id=self.conversation_id).exclude(sender_id=self.user_id)
+        if self.last_read_at is None:
+            return messages
+        after = Q(sent_at__gt=self.last_read_at)
+        if self.last_read_message_id is not None:
+            after |= Q(sent_at=self.last_read_at, message_id__gt=self.last_read_message_id)
+        return messages.filter(after)
+
+    def count_unread(self):
+        return self.unread_messages().count() + self.unread_messages(ArchivedMessage).count()
+
+    def mark_read(self, message):
+        """
+        Move the read position forward to message and recount what is left.
+        Marking an older message read is a no-op, so a client paging back
+        through history cannot make newer messages unread again.
+        """
+        if self.last_read_at is not None and (
+            (message.sent_at, message.pk) <= (self.last_read_at, self.last_read_message_id or message.pk)
+        ):
+            return False
+        self.last_read_message = message
+        self.last_read_at = message.sent_at
+        self.unread_count = self.count_unread()
+        self.save(update_fields=['last_read_message', 'last_read_at', 'unread_count'])
+        return True
+
+    @classmethod
+    def recount(cls, conversation):
+        """Recompute every participant's count, e.g. after a delete."""
+        for state in cls.objects.filter(conversation=conversation):
+            unread = state.count_unread()
+            if unread != state.unread_count:
+                cls.objects.filter(pk=state.pk).update(unread_count=unread)
+
+class RevokedToken(models.Model):
+    """
+    A revoked refresh token, remembered only until it would have expired
+    anyway (see chats.revocation).
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.jti} (until {self.expires_at})"
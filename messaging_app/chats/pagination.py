@@ -0,0 +1,125 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination for conversation messages, ordered by
+    (sent_at, message_id). The cursor holds the (sent_at, message_id) of the
+    last message of a page (the first, for a previous link), and the next
+    page is the messages after that pair, so each page is an indexed range
+    scan however long the history is and however many messages share one
+    sent_at. Cursors use the format of encode_sync_cursor, plus a flag for
+    previous links.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('sent_at', 'message_id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        queryset = queryset.order_by(*(f'-{field}' for field in self.ordering) if reverse else self.ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(keyset_after(*self.cursor.position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            # The cursor's own message is on the following page
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # An empty previous page is before the first message
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=message_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = message_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_cursor(self, cursor):
+        encoded = encode_position(*cursor.position, reverse=cursor.reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            sent_at, message_id, reverse = decode_position(encoded)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=(sent_at, message_id))
+
+
+def message_position(message):
+    """(sent_at, message_id) of a message, or of a values() row."""
+    if isinstance(message, dict):
+        return message['sent_at'], message['message_id']
+    return message.sent_at, message.message_id
+
+
+def keyset_after(sent_at, message_id, reverse=False):
+    """Q for messages after (before, if reverse) a position in (sent_at, message_id) order."""
+    lookup = 'lt' if reverse else 'gt'
+    # The range on sent_at alone is redundant, but lets the database seek the index
+    return Q(**{f'sent_at__{lookup}e': sent_at}) & (
+        Q(**{f'sent_at__{lookup}': sent_at}) | Q(sent_at=sent_at, **{f'message_id__{lookup}': message_id})
+    )
+
+
+def encode_position(sent_at, message_id, reverse=False):
+    raw = f'{sent_at.isoformat()}|{message_id}' + ('|r' if reverse else '')
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_position(cursor):
+    """Return (sent_at, message_id, reverse) for a cursor, or raise ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        sent_at, message_id, *flags = raw.split('|')
+        if flags not in ([], ['r']):
+            raise ValueError('Invalid cursor.')
+        return datetime.fromisoformat(sent_at), uuid.UUID(message_id), bool(flags)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as exc:
+        raise ValueError('Invalid cursor.') from exc
+
+
+def encode_sync_cursor(message):
+    """Opaque cursor for the (sent_at, message_id) position of a message."""
+    return encode_position(*message_position(message))
+
+
+def decode_sync_cursor(cursor):
+    """Return (sent_at, message_id) for a cursor, or raise ValueError."""
+    sent_at, message_id, reverse = decode_position(cursor)
+    if reverse:
+        raise ValueError('Invalid cursor.')
+    return sent_at, message_id
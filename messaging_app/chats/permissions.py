@@ -1,6 +1,63 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import permissions
 from .models import Conversation
 
+Participant = Conversation.participants.through
+
+
+def membership_cache_key(user_id, conversation_id):
+    return f"chats:member:{user_id}:{conversation_id}"
+
+
+def is_participant(request, conversation_id):
+    """
+    Return whether request.user participates in the conversation.
+
+    Runs a single EXISTS against the participants through table (covered by
+    its unique (conversation, user) index) and memoizes the answer on the
+    request, so the view and the permission class share one lookup. When
+    CHATS_MEMBERSHIP_CACHE_TTL is set, answers are also kept in the Django
+    cache for that many seconds; participant changes invalidate them.
+    """
+    user = request.user
+    if not user or not user.is_authenticated:
+        return False
+
+    memo = getattr(request, '_membership_memo', None)
+    if memo is None:
+        memo = request._membership_memo = {}
+    key = membership_cache_key(user.pk, conversation_id)
+    if key in memo:
+        return memo[key]
+    try:
+        uuid.UUID(str(conversation_id))
+    except ValueError:
+        # A malformed id (from the URL) matches no conversation
+        return False
+
+    ttl = getattr(settings, 'CHATS_MEMBERSHIP_CACHE_TTL', 0)
+    member = cache.get(key) if ttl else None
+    if member is None:
+        member = Participant.objects.filter(
+            conversation_id=conversation_id, customuser_id=user.pk
+        ).exists()
+        if ttl:
+            cache.set(key, member, ttl)
+
+    memo[key] = member
+    return member
+
+
+def invalidate_membership(user_ids, conversation_ids):
+    cache.delete_many([
+        membership_cache_key(user_id, conversation_id)
+        for user_id in user_ids
+        for conversation_id in conversation_ids
+    ])
+
+
 class IsParticipantOfConversation(permissions.BasePermission):
     """
 - Only authenticated users can access the API.
@@ -16,10 +73,10 @@ class IsParticipantOfConversation(permissions.BasePermission):
         Check if the user is a participant in the conversation.
         Works for both Conversation and Message objects.
         """
-        if hasattr(obj, "participants"):  # conversation instance
-            return request.user in obj.participants.all()
+        if isinstance(obj, Conversation):
+            return is_participant(request, obj.pk)
 
-        if hasattr(obj, "conversation"):  # message instance
-            return request.user in obj.conversation.participants.all()
+        if hasattr(obj, "conversation_id"):  # message instance
+            return is_participant(request, obj.conversation_id)
 
         return False
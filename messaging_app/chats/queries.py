@@ -0,0 +1,36 @@
+from django.db.models import F, FilteredRelation, Q, Value
+from django.db.models.functions import Coalesce
+from .archive import MessageHistory
+from .models import Conversation, Message
+
+
+def user_conversations(user):
+    # Conversations the user is a participant in, most recently active first,
+    # with the participants prefetched so serializing N conversations costs a
+    # constant number of queries; history lives on the messages route. The
+    # caller's unread count is joined from their read state row
+    return Conversation.objects.filter(participants=user).annotate(
+        my_read_state=FilteredRelation('read_states', condition=Q(read_states__user=user)),
+        unread_count=Coalesce(F('my_read_state__unread_count'), Value(0)),
+    ).prefetch_related(
+        'participants',
+    ).order_by(F('last_message_at').desc(nulls_last=True), '-created_at')
+
+
+def user_conversation_details(user):
+    # Single-conversation reads also show everyone's read receipts
+    return user_conversations(user).prefetch_related('read_states')
+
+
+def conversation_messages(conversation_id):
+    return Message.objects.filter(conversation_id=conversation_id).select_related(
+        'sender'
+    ).order_by('sent_at', 'message_id')
+
+
+def conversation_history(conversation_id):
+    # conversation_messages plus anything archived, for reads that may page
+    # back past the hot table
+    return MessageHistory.filter_both(conversation_id=conversation_id).select_related(
+        'sender'
+    ).order_by('sent_at', 'message_id')
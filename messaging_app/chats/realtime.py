@@ -0,0 +1,155 @@
+"""
+Push delivery of new messages to connected WebSocket clients.
+
+Views publish through get_broadcaster(); the ASGI WebSocket handler in
+chats.consumers subscribes one queue per socket. The backend is chosen by
+CHATS_BROADCAST_BACKEND, so the in-process broadcaster can be swapped for
+one backed by a shared bus (e.g. Redis pub/sub) when running several
+worker processes.
+"""
+import asyncio
+import functools
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+
+class Subscription:
+    """A single socket's view of a conversation channel."""
+
+    def __init__(self, broadcaster, conversation_id, maxsize):
+        self.broadcaster = broadcaster
+        self.conversation_id = conversation_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def deliver(self, payload):
+        # Runs on the subscriber's loop; slow consumers drop events rather
+        # than buffering without bound
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    """
+    Interface for broadcast backends.
+
+    subscribe() is called from the event loop serving the socket; publish()
+    may be called from any thread, including sync views.
+    """
+
+    def subscribe(self, conversation_id):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, conversation_id, payload):
+        raise NotImplementedError
+
+    def has_subscribers(self, conversation_id):
+        # Backends that fan out across processes cannot know this locally
+        return True
+
+
+class InMemoryBroadcaster(Broadcaster):
+    """Fans out to sockets connected to this process only."""
+
+    def __init__(self):
+        self.queue_size = getattr(settings, 'CHATS_BROADCAST_QUEUE_SIZE', 100)
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, conversation_id):
+        subscription = Subscription(self, str(conversation_id), self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(subscription.conversation_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.conversation_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.conversation_id]
+
+    def publish(self, conversation_id, payload):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(str(conversation_id), ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, payload)
+            except RuntimeError:  # loop already closed
+                self.unsubscribe(subscription)
+
+    def has_subscribers(self, conversation_id):
+        return str(conversation_id) in self._subscriptions
+
+
+@functools.lru_cache(maxsize=None)
+def get_broadcaster():
+    backend = getattr(settings, 'CHATS_BROADCAST_BACKEND', 'chats.realtime.InMemoryBroadcaster')
+    return import_string(backend)()
+
+
+def broadcast_messages(conversation, messages):
+    """
+    Publish newly created messages to the conversation's subscribers once
+    the surrounding transaction commits. Each event is rendered once and the
+    same text frame is sent to every socket.
+    """
+    broadcaster = get_broadcaster()
+    if not broadcaster.has_subscribers(conversation.pk):
+        return
+
+    from .serializers import MessageSerializer
+
+    renderer = JSONRenderer()
+    payloads = [
+        renderer.render({
+            'type': 'message.created',
+            'conversation_id': str(conversation.pk),
+            'message': data,
+        }).decode()
+        for data in MessageSerializer(messages, many=True).data
+    ]
+
+    def publish():
+        for payload in payloads:
+            broadcaster.publish(conversation.pk, payload)
+
+    transaction.on_commit(publish)
+
+
+PARTICIPANTS_REMOVED = 'participants.removed'
+# Control frames start with their type; sockets check this prefix instead
+# of parsing every message frame
+PARTICIPANTS_REMOVED_PREFIX = f'{{"type":"{PARTICIPANTS_REMOVED}"'
+
+
+def broadcast_removed_participants(conversation_id, user_ids):
+    """
+    Once the surrounding transaction commits, close the sockets that the
+    removed users have open on the conversation. The control frame is
+    consumed by chats.consumers and never reaches clients.
+    """
+    broadcaster = get_broadcaster()
+    if not broadcaster.has_subscribers(conversation_id):
+        return
+    payload = JSONRenderer().render({
+        'type': PARTICIPANTS_REMOVED,
+        'conversation_id': str(conversation_id),
+        'user_ids': [str(user_id) for user_id in user_ids],
+    }).decode()
+    transaction.on_commit(lambda: broadcaster.publish(conversation_id, payload))
@@ -0,0 +1,52 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+from .instrumentation import timed_serialization
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Output is byte-identical to JSONRenderer for compact, non-indented,
+    unicode responses (the defaults); any other configuration, or data
+    orjson cannot encode, falls back to the stdlib json path.
+    """
+    default = staticmethod(encoders.JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_serialization():
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # orjson would write datetimes itself (+00:00, microseconds);
+            # passing them through sends them to DRF's encoder (Z, milliseconds)
+            ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Match JSONRenderer, which always escapes these two separators
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class PrometheusTextRenderer(BaseRenderer):
+    """Pass through metrics already in the Prometheus text exposition format."""
+    # Without the version parameter, which would stop it matching */*
+    media_type = 'text/plain'
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):  # error responses carry a detail dict
+            return JSONRenderer().render(data)
+        return data.encode(self.charset)
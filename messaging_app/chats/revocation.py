@@ -0,0 +1,118 @@
+"""
+Refresh-token revocation with bounded storage.
+
+Revoked jtis live in RevokedToken (unique, indexed) only until the token
+would have expired anyway; compact() deletes the rest and runs on its own
+every CHATS_REVOCATION_COMPACT_INTERVAL seconds, so the table holds at most
+one refresh lifetime of revocations no matter how many tokens are issued.
+
+A process-local Bloom filter over the stored jtis answers "definitely not
+revoked" without a query, which is the answer for almost every refresh.
+Each process pulls rows added elsewhere every CHATS_REVOCATION_SYNC_INTERVAL
+seconds and rebuilds the filter after compacting. Rotation does not depend
+on that window: revoke() claims the jti with a unique insert, so a refresh
+token can be rotated only once across all processes.
+"""
+import functools
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import RevokedToken
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for capacity and error_rate."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationStore:
+    def __init__(self):
+        self.capacity = settings.CHATS_REVOCATION_BLOOM_CAPACITY
+        self.error_rate = settings.CHATS_REVOCATION_BLOOM_ERROR_RATE
+        self.sync_interval = settings.CHATS_REVOCATION_SYNC_INTERVAL
+        self.compact_interval = settings.CHATS_REVOCATION_COMPACT_INTERVAL
+        self._lock = threading.RLock()
+        self._bloom = None
+        self._last_id = 0
+        self._synced_at = self._compacted_at = time.monotonic()
+
+    def _rebuild(self):
+        rows = list(RevokedToken.objects.values_list('pk', 'jti'))
+        # Grow rather than let the false-positive rate climb
+        capacity = max(self.capacity, len(rows) * 2)
+        self._bloom = BloomFilter(capacity, self.error_rate)
+        for pk, jti in rows:
+            self._bloom.add(jti)
+        self._last_id = max((pk for pk, _ in rows), default=0)
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._bloom is None:
+            self._rebuild()
+        elif now - self._compacted_at >= self.compact_interval:
+            self.compact()
+        elif now - self._synced_at >= self.sync_interval:
+            for pk, jti in RevokedToken.objects.filter(pk__gt=self._last_id).values_list('pk', 'jti'):
+                self._bloom.add(jti)
+                self._last_id = max(self._last_id, pk)
+            if self._bloom.count > self._bloom.capacity:
+                self._rebuild()
+        else:
+            return
+        self._synced_at = now
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self._sync()
+            if jti not in self._bloom:
+                return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+    def revoke(self, jti, expires_at):
+        """Revoke jti; returns False if it was already revoked."""
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        with self._lock:
+            self._sync()
+            self._bloom.add(jti)
+        return True
+
+    def compact(self):
+        """Forget revocations of tokens that have expired anyway."""
+        with self._lock:
+            RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+            self._rebuild()
+            self._compacted_at = time.monotonic()
+
+
+@functools.lru_cache(maxsize=None)
+def get_revocation_store():
+    return RevocationStore()
@@ -0,0 +1,109 @@
+"""
+Read-replica routing for chats' read traffic.
+
+Reads of conversations, messages and users made while serving a request go
+to one of CHATS_READ_REPLICAS; everything else goes to the primary
+(default) database. A request stays on the primary when
+
+- its method is not GET/HEAD/OPTIONS,
+- it has written anything, or is inside a transaction on the primary, or
+- its user wrote within the last CHATS_REPLICA_PIN_SECONDS, so clients
+  read their own writes despite replication lag.
+
+Per-request state lives in a context variable set by
+chats.middleware.ReplicaRoutingMiddleware; queries made outside a request
+(management commands, shells, tests) always use the primary. Recent
+writers are remembered in the Django cache named by CHATS_REPLICA_PIN_CACHE
+so the window holds across worker processes.
+
+A request sticks to one replica once it has picked it, so its reads never
+go back in time between replicas with different lag.
+"""
+import contextlib
+import contextvars
+import random
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+ROUTED_MODELS = {'chats.conversation', 'chats.message', 'chats.archivedmessage', 'chats.customuser'}
+
+_state = contextvars.ContextVar('chats_db_routing', default=None)
+
+
+class RoutingState:
+    __slots__ = ('primary', 'wrote', 'user_id', 'replica')
+
+    def __init__(self, primary=False):
+        self.primary = primary
+        self.wrote = False
+        self.user_id = None
+        self.replica = None
+
+
+@contextlib.contextmanager
+def routing_state(primary=False):
+    """Route the ORM calls made inside the block as one request's."""
+    state = RoutingState(primary)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def _pin_key(user_id):
+    return f'chats:replica-pin:{user_id}'
+
+
+def identify(user_id):
+    """Record who the current request is for, keeping recent writers on the primary."""
+    state = _state.get()
+    if state is None:
+        return
+    state.user_id = user_id
+    if not state.primary and settings.CHATS_READ_REPLICAS:
+        pinned_until = caches[settings.CHATS_REPLICA_PIN_CACHE].get(_pin_key(user_id))
+        state.primary = pinned_until is not None and pinned_until > time.time()
+
+
+def record_write(state):
+    """Keep the state's user on the primary for the next CHATS_REPLICA_PIN_SECONDS."""
+    window = settings.CHATS_REPLICA_PIN_SECONDS
+    if state.wrote and state.user_id is not None and window > 0 and settings.CHATS_READ_REPLICAS:
+        caches[settings.CHATS_REPLICA_PIN_CACHE].set(
+            _pin_key(state.user_id), time.time() + window, timeout=int(window) + 1
+        )
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.CHATS_READ_REPLICAS
+        if state is None or state.primary or not replicas or model._meta.label_lower not in ROUTED_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.CHATS_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in settings.CHATS_READ_REPLICAS:
+            return False
+        return None
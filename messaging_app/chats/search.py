@@ -0,0 +1,170 @@
+"""
+Full-text search over message bodies.
+
+The backend is chosen by CHATS_SEARCH_BACKEND. Each backend installs what
+it needs with install(); that runs after every migrate, because SQLite
+drops triggers whenever Django rebuilds a table. Migrations from 0012 on
+carry frozen copies of the SQL instead of calling install().
+search() returns ranked message ids. Pagination is limit/offset because
+the results are ordered by relevance.
+"""
+import functools
+import re
+import uuid
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+from .models import Message
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchBackend:
+    def install(self, connection):
+        """Create any indexes/triggers the backend needs (idempotent)."""
+
+    def optimize(self, connection):
+        """Compact the index after many deletes, e.g. archiving."""
+
+    def search(self, conversation_ids, query, limit, offset):
+        """Return up to limit message ids matching query, best match first."""
+        raise NotImplementedError
+
+
+class IContainsSearchBackend(SearchBackend):
+    """Unindexed substring match; works everywhere, scans every message."""
+
+    def search(self, conversation_ids, query, limit, offset):
+        queryset = Message.objects.filter(conversation_id__in=conversation_ids)
+        for token in TOKEN_RE.findall(query):
+            queryset = queryset.filter(message_body__icontains=token)
+        ids = queryset.order_by('-sent_at', '-message_id').values_list('message_id', flat=True)
+        return list(ids[offset:offset + limit])
+
+
+class SQLiteFTS5SearchBackend(SearchBackend):
+    """
+    SQLite FTS5 external-content index over chats_message.message_body,
+    kept current by insert/update/delete triggers (so bulk_create and
+    queryset updates are covered too) and ranked with bm25. The triggers
+    index chats_body_text(message_body), the text of compressed bodies.
+    """
+    table = 'chats_message_fts'
+    triggers = {
+        'chats_message_fts_ai': """
+            CREATE TRIGGER chats_message_fts_ai AFTER INSERT ON chats_message BEGIN
+                INSERT INTO chats_message_fts(rowid, message_body)
+                VALUES (new.rowid, chats_body_text(new.message_body));
+            END""",
+        'chats_message_fts_ad': """
+            CREATE TRIGGER chats_message_fts_ad AFTER DELETE ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, chats_body_text(old.message_body));
+            END""",
+        'chats_message_fts_au': """
+            CREATE TRIGGER chats_message_fts_au AFTER UPDATE OF message_body ON chats_message BEGIN
+                INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body)
+                VALUES ('delete', old.rowid, chats_body_text(old.message_body));
+                INSERT INTO chats_message_fts(rowid, message_body)
+                VALUES (new.rowid, chats_body_text(new.message_body));
+            END""",
+    }
+
+    def install(self, connection):
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "message_body, content='chats_message', content_rowid='rowid', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                list(self.triggers),
+            )
+            existing = dict(cursor.fetchall())
+            wanted = {name: sql.strip() for name, sql in self.triggers.items()}
+            if existing == wanted:
+                return
+            for name, sql in wanted.items():
+                if existing.get(name) != sql:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    cursor.execute(sql)
+            # Triggers were missing or outdated (new install, the table was
+            # rebuilt, or they changed), so the index may be stale: rebuild
+            # it from the content table. FTS5's own rebuild would index
+            # compressed bodies as they are stored
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('delete-all')")
+            cursor.execute(
+                f"INSERT INTO {self.table}(rowid, message_body) "
+                "SELECT rowid, chats_body_text(message_body) FROM chats_message"
+            )
+
+    def optimize(self, connection):
+        if connection.vendor != 'sqlite':
+            return
+        # Deletes only add tombstones; merging the segments drops them
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+
+    def match_expression(self, query):
+        # Quote every token so user input can never be FTS5 syntax; the last
+        # token is a prefix match to support search-as-you-type
+        tokens = TOKEN_RE.findall(query)
+        if not tokens:
+            return None
+        return ' '.join(f'"{t}"' for t in tokens) + '*'
+
+    def search(self, conversation_ids, query, limit, offset):
+        match = self.match_expression(query)
+        if match is None or not conversation_ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(conversation_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT m.message_id FROM {self.table} f "
+                f"JOIN chats_message m ON m.rowid = f.rowid "
+                f"WHERE {self.table} MATCH %s AND m.conversation_id IN ({placeholders}) "
+                f"ORDER BY bm25({self.table}), m.sent_at DESC LIMIT %s OFFSET %s",
+                # UUIDs are stored as 32-char hex on SQLite
+                [match, *(uuid.UUID(str(c)).hex for c in conversation_ids), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    PostgreSQL full-text search over a GIN expression index; Postgres keeps
+    the index current itself, so there is nothing to maintain per write.
+    """
+    config = 'english'
+
+    def install(self, connection):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS chats_message_body_fts ON chats_message "
+                f"USING GIN (to_tsvector('{self.config}', message_body))"
+            )
+
+    def search(self, conversation_ids, query, limit, offset):
+        if not conversation_ids:
+            return []
+        # Same expression as the index so the planner can use it
+        document = f"to_tsvector('{self.config}', message_body)"
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT message_id FROM chats_message "
+                f"WHERE {document} @@ {tsquery} AND conversation_id = ANY(%s) "
+                f"ORDER BY ts_rank({document}, {tsquery}) DESC, sent_at DESC LIMIT %s OFFSET %s",
+                [query, list(conversation_ids), query, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(settings.CHATS_SEARCH_BACKEND)()
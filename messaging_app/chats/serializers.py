@@ -1,5 +1,9 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import CustomUser, Message, Conversation
+from .compression import decode_body
+from .instrumentation import TimedRepresentationMixin, timed_serialization
+from .models import CustomUser, Message, Conversation, ConversationReadState
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,7 +25,23 @@ class UserCreateSerializer(serializers.ModelSerializer):
         user.save()
         return user
 
-class MessageSerializer(serializers.ModelSerializer):
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    One row of a bulk user import. Email uniqueness is checked per batch by
+    chats.user_import rather than with a query per row, and a missing
+    password makes the row an invitation.
+    """
+    email = serializers.EmailField(max_length=254)
+    password = serializers.CharField(required=False, allow_blank=True)
+
+    class Meta:
+        model = CustomUser
+        fields = ['first_name', 'last_name', 'email', 'password', 'phone_number', 'role']
+
+    def validate_email(self, value):
+        return CustomUser.objects.normalize_email(value)
+
+class MessageSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
 
     class Meta:
@@ -29,42 +49,131 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['message_id', 'sender', 'message_body', 'sent_at']
         read_only_fields = ['message_id', 'sent_at', 'sender']
 
-class ConversationSerializer(serializers.ModelSerializer):
-    participants = UserSerializer(many=True, read_only=True)
-    messages = MessageSerializer(many=True, read_only=True)
+# Fast path for message lists: read rows with values() and build the same
+# dicts MessageSerializer would, skipping per-field to_representation calls
+_sender_fields = UserSerializer.Meta.fields
+_message_values = ['message_id', *(f'sender__{f}' for f in _sender_fields), 'message_body', 'sent_at']
+
+
+def message_values(queryset):
+    """Narrow a Message queryset to the columns message_rows() needs."""
+    return queryset.values(*_message_values)
+
+
+def message_rows(rows):
+    """Build MessageSerializer-identical output from message_values() rows."""
+    # Resolve the output timezone once rather than per value
+    to_datetime = serializers.DateTimeField(
+        default_timezone=timezone.get_current_timezone() if settings.USE_TZ else None
+    ).to_representation
+    sender_keys = [(f, f'sender__{f}') for f in _sender_fields]
+    data = []
+    with timed_serialization():
+        for row in rows:
+            sender = {field: row[key] for field, key in sender_keys}
+            sender['user_id'] = str(sender['user_id'])
+            sender['created_at'] = to_datetime(sender['created_at'])
+            data.append({
+                'message_id': str(row['message_id']),
+                'sender': sender,
+                # values() rows carry compressed bodies as stored
+                'message_body': decode_body(row['message_body']),
+                'sent_at': to_datetime(row['sent_at']),
+            })
+    return data
+
+class MessageSyncSerializer(MessageSerializer):
+    """A message as returned by the cross-conversation sync endpoint."""
+    conversation_id = serializers.UUIDField(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
+        fields = ['conversation_id'] + MessageSerializer.Meta.fields
+
+class ParticipantSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ['user_id', 'first_name', 'last_name']
+
+class ConversationInboxSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    """
+    Compact inbox row: who is in the conversation, a preview of the latest
+    message and the caller's unread count (annotated by user_conversations).
+    Message history is served by the paginated nested messages route, never
+    embedded here.
+    """
+    participants = ParticipantSummarySerializer(many=True, read_only=True)
     latest_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Conversation
-        fields = ['conversation_id', 'participants', 'messages', 'latest_message', 'created_at']
+        fields = ['conversation_id', 'participants', 'latest_message', 'message_count', 'unread_count', 'created_at']
+        read_only_fields = ['message_count']
 
     def get_latest_message(self, obj):
-        last_msg = obj.messages.order_by('-sent_at').first()
-        if last_msg:
-            return MessageSerializer(last_msg).data
-        return None
+        # Built from the denormalized summary columns, no extra queries
+        if obj.last_message_id is None:
+            return None
+        return {
+            'message_id': str(obj.last_message_id),
+            'sender_id': str(obj.last_message_sender_id) if obj.last_message_sender_id else None,
+            'preview': obj.last_message_preview,
+            'sent_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+class ReadReceiptSerializer(serializers.ModelSerializer):
+    user_id = serializers.UUIDField(read_only=True)
+    last_read_message_id = serializers.UUIDField(read_only=True)
+
+    class Meta:
+        model = ConversationReadState
+        fields = ['user_id', 'last_read_message_id', 'last_read_at']
+
+class ConversationSerializer(ConversationInboxSerializer):
+    participants = UserSerializer(many=True, read_only=True)
+    read_receipts = ReadReceiptSerializer(source='read_states', many=True, read_only=True)
+
+    class Meta(ConversationInboxSerializer.Meta):
+        fields = ConversationInboxSerializer.Meta.fields + ['read_receipts']
+
+class MarkReadSerializer(serializers.Serializer):
+    message_id = serializers.UUIDField(required=False)
 
 
 class ConversationCreateSerializer(serializers.ModelSerializer):
+    """
+    Returns the existing conversation for exactly these participants when
+    there is one (set reuse_existing to false to always start a new one);
+    self.created tells the view which happened. The requesting user is
+    always a participant, so only their own conversations are reused.
+    """
     participant_ids = serializers.ListField(
         child=serializers.UUIDField(),
         write_only=True
     )
+    reuse_existing = serializers.BooleanField(default=True, write_only=True)
 
     class Meta:
         model = Conversation
-        fields = ['conversation_id', 'participant_ids', 'created_at']
+        fields = ['conversation_id', 'participant_ids', 'reuse_existing', 'created_at']
         read_only_fields = ['conversation_id', 'created_at']
 
     def validate_participant_ids(self, value):
+        # Unknown ids are dropped, as before
+        value = set(CustomUser.objects.filter(user_id__in=value).values_list('user_id', flat=True))
+        value.add(self.context['request'].user.pk)
+        value = list(value)
         if len(value) < 2:
             raise serializers.ValidationError("A conversation must have at least 2 participants.")
         return value
 
     def create(self, validated_data):
         participant_ids = validated_data.pop('participant_ids')
+        if validated_data.pop('reuse_existing'):
+            conversation, self.created = Conversation.get_or_create_for(participant_ids)
+            return conversation
         conversation = Conversation.objects.create()
-        users = CustomUser.objects.filter(user_id__in=participant_ids)
-        conversation.participants.set(users)
+        conversation.participants.add(*participant_ids)
+        self.created = True
         return conversation
 
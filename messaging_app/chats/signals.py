@@ -0,0 +1,118 @@
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .authentication import get_user_cache
+from .compression import decode_body
+from .instrumentation import record_query
+from .models import Conversation, ConversationReadState, CustomUser
+from .permissions import invalidate_membership
+from .realtime import broadcast_removed_participants
+from .search import get_search_backend
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop cached membership answers, keep read states in step with the
+    participants, close removed users' sockets, bump the conversation
+    version and release its participant key when a participant set changes.
+    """
+    if action == 'pre_clear':
+        # pk_set is not provided for clear(); capture the rows being removed
+        if reverse:
+            pk_set = set(instance.conversations.values_list('pk', flat=True))
+        else:
+            pk_set = set(instance.participants.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+
+    if reverse:  # instance is a user, pk_set holds conversation ids
+        pairs = [(conversation_id, instance.pk) for conversation_id in pk_set]
+        conversation_ids = pk_set
+        invalidate_membership([instance.pk], pk_set)
+    else:
+        pairs = [(instance.pk, user_id) for user_id in pk_set]
+        conversation_ids = [instance.pk]
+        invalidate_membership(pk_set, [instance.pk])
+
+    if action == 'post_add':
+        add_read_states(pairs)
+    else:
+        for conversation_id, user_ids in removed_by_conversation(pairs).items():
+            broadcast_removed_participants(conversation_id, user_ids)
+        ConversationReadState.objects.filter(
+            conversation_id__in=conversation_ids,
+            user_id__in=[instance.pk] if reverse else pk_set,
+        ).delete()
+    # A changed set no longer matches the conversation's participant key
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        version=F('version') + 1, participant_key=None,
+    )
+
+
+def removed_by_conversation(pairs):
+    removed = {}
+    for conversation_id, user_id in pairs:
+        removed.setdefault(conversation_id, []).append(user_id)
+    return removed
+
+
+def add_read_states(pairs):
+    """
+    New participants start caught up: history from before they joined does
+    not count as unread.
+    """
+    conversation_ids = {conversation_id for conversation_id, _ in pairs}
+    positions = {
+        pk: (message_id, sent_at)
+        for pk, message_id, sent_at in Conversation.objects.filter(pk__in=conversation_ids).values_list(
+            'pk', 'last_message_id', 'last_message_at'
+        )
+    }
+    ConversationReadState.objects.bulk_create(
+        [
+            ConversationReadState(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                last_read_message_id=positions[conversation_id][0],
+                last_read_at=positions[conversation_id][1],
+            )
+            for conversation_id, user_id in pairs
+            if conversation_id in positions
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    # Deactivation, role changes and revocations apply at once in this process
+    get_user_cache().discard(instance.pk)
+
+
+def install_search_index(using='default', **kwargs):
+    """
+    Re-run the search backend's install after migrate: SQLite drops the
+    FTS triggers whenever a migration rebuilds chats_message.
+    """
+    get_search_backend().install(connections[using])
+
+
+@receiver(connection_created)
+def instrument_connection(connection, **kwargs):
+    # Fires again when a persistent connection reconnects; the wrapper
+    # list belongs to the connection handler, so install it only once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def register_sql_functions(connection, **kwargs):
+    # The full-text search triggers index compressed bodies through this
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('chats_body_text', 1, decode_body, deterministic=True)
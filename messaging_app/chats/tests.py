@@ -1,3 +1,1317 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import get_user_cache
+from .compression import compress_body
+from .consumers import conversation_socket
+from .hashers import HashingPool
+from .instrumentation import registry
+from .models import ArchivedMessage, CustomUser, Conversation, ConversationReadState, Message, RevokedToken
+from .pagination import encode_sync_cursor
+from .queries import conversation_messages
+from .realtime import get_broadcaster
+from .renderers import FastJSONRenderer
+from .revocation import RevocationStore
+from .routers import identify, record_write, routing_state
+from .throttling import LocalTokenBucket, get_token_bucket, metrics as throttle_metrics
+from .serializers import MessageSerializer, message_rows, message_values
 
-# Create your tests here.
+
+def setUpModule():
+    # Buckets live for the whole process; throttling gets its own tests
+    override_settings(CHATS_THROTTLE_ENABLED=False).enable()
+
+
+def make_user(email):
+    return CustomUser.objects.create_user(
+        email=email, password='pass1234', first_name='Test',
+        last_name='User', role='guest',
+    )
+
+
+class ParticipantsTestCase(TestCase):
+    """Two users, self.user and self.other; self.client is signed in as self.user."""
+
+    def setUp(self):
+        self.user = make_user('owner@example.com')
+        self.other = make_user('other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class ConversationTestCase(ParticipantsTestCase):
+    """ParticipantsTestCase plus self.conversation between the two users."""
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.user, self.other])
+
+
+class ConversationListQueryTest(ParticipantsTestCase):
+    def add_conversations(self, count):
+        for _ in range(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.user, self.other])
+            for sender, body in [(self.user, 'hi'), (self.other, 'hello')]:
+                message = Message.objects.create(conversation=conversation, sender=sender, message_body=body)
+                conversation.record_message(message)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_is_flat(self):
+        self.add_conversations(2)
+        small, _ = self.count_list_queries()
+        self.add_conversations(10)
+        large, data = self.count_list_queries()
+        self.assertEqual(len(data), 12)
+        self.assertEqual(small, large)
+
+    def test_latest_message_comes_from_summary(self):
+        self.add_conversations(1)
+        _, data = self.count_list_queries()
+        self.assertEqual(data[0]['latest_message']['preview'], 'hello')
+        self.assertEqual(data[0]['latest_message']['sender_id'], str(self.other.pk))
+        self.assertEqual(data[0]['message_count'], 2)
+
+    def test_list_is_compact_and_detail_has_full_participants(self):
+        self.add_conversations(1)
+        _, data = self.count_list_queries()
+        self.assertNotIn('messages', data[0])
+        self.assertEqual(set(data[0]['participants'][0]), {'user_id', 'first_name', 'last_name'})
+        detail = self.client.get(f"/api/conversations/{data[0]['conversation_id']}/").json()
+        self.assertNotIn('messages', detail)
+        self.assertIn('email', detail['participants'][0])
+
+
+class LastMessageSummaryTest(ParticipantsTestCase):
+    def new_conversation(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.set([self.user, self.other])
+        return conversation
+
+    def post_message(self, conversation, body):
+        response = self.client.post(
+            f'/api/conversations/{conversation.pk}/messages/', {'message_body': body}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_create_and_delete_maintain_summary(self):
+        conversation = self.new_conversation()
+        self.post_message(conversation, 'first')
+        second = self.post_message(conversation, 'x' * 300)
+        conversation.refresh_from_db()
+        self.assertEqual(str(conversation.last_message_id), second['message_id'])
+        self.assertEqual(conversation.last_message_preview, 'x' * 100)
+        self.assertEqual(conversation.message_count, 2)
+
+        self.client.delete(f'/api/conversations/{conversation.pk}/messages/{second["message_id"]}/')
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_preview, 'first')
+        self.assertEqual(conversation.message_count, 1)
+
+    def test_out_of_order_commits_keep_newest_summary(self):
+        conversation = self.new_conversation()
+        older = Message.objects.create(conversation=conversation, sender=self.user, message_body='older')
+        newer = Message.objects.create(conversation=conversation, sender=self.other, message_body='newer')
+        # The later send commits first
+        conversation.record_message(newer)
+        conversation.record_message(older)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, newer)
+        self.assertEqual(conversation.last_message_preview, 'newer')
+        self.assertEqual(conversation.message_count, 2)
+
+    def test_inbox_sorted_by_last_activity(self):
+        older, newer, empty = self.new_conversation(), self.new_conversation(), self.new_conversation()
+        self.post_message(newer, 'one')
+        self.post_message(older, 'two')
+        data = self.client.get('/api/conversations/').json()
+        self.assertEqual(
+            [c['conversation_id'] for c in data],
+            [str(older.pk), str(newer.pk), str(empty.pk)],
+        )
+
+
+class MessageCursorPaginationTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'm{i}')
+
+    def test_pages_walk_history_in_order(self):
+        url = f'/api/conversations/{self.conversation.pk}/messages/?page_size=2'
+        bodies = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['results']), 2)
+            bodies += [m['message_body'] for m in data['results']]
+            url = data['next']
+        self.assertEqual(bodies, [f'm{i}' for i in range(5)])
+
+    def test_pages_step_through_messages_sharing_sent_at(self):
+        # More ties than DRF's offset_cutoff lets an offset cursor skip
+        Message.objects.update(sent_at=timezone.now())
+        expected = list(Message.objects.order_by('message_id').values_list('message_body', flat=True))
+        for fast in (True, False):
+            with self.settings(CHATS_FAST_SERIALIZATION=fast), \
+                    mock.patch('chats.pagination.MessageCursorPagination.offset_cutoff', 1):
+                url = f'/api/conversations/{self.conversation.pk}/messages/?page_size=2'
+                pages = []
+                while url and len(pages) < 10:
+                    data = self.client.get(url).json()
+                    pages.append([m['message_body'] for m in data['results']])
+                    url, previous = data['next'], data['previous']
+                self.assertEqual(sum(pages, []), expected)
+
+                # And back again from the last page
+                while previous:
+                    data = self.client.get(previous).json()
+                    self.assertEqual([m['message_body'] for m in data['results']], pages[-2])
+                    pages.pop()
+                    previous = data['previous']
+                self.assertEqual(len(pages), 1)
+
+
+class MembershipCheckTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.outsider = make_user('outsider@example.com')
+        self.message = Message.objects.create(
+            conversation=self.conversation, sender=self.user, message_body='hi'
+        )
+
+    def membership_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        membership = [q for q in ctx.captured_queries if 'chats_conversation_participants' in q['sql']]
+        return response, len(membership)
+
+    def test_retrieve_message_checks_membership_once(self):
+        self.client.force_authenticate(self.user)
+        url = f'/api/conversations/{self.conversation.pk}/messages/{self.message.pk}/'
+        response, queries = self.membership_queries(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+
+    def test_outsider_sees_nothing_and_cannot_post(self):
+        self.client.force_authenticate(self.outsider)
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.assertEqual(self.client.get(url).json()['results'], [])
+        response = self.client.post(url, {'message_body': 'hey'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(CHATS_MEMBERSHIP_CACHE_TTL=60)
+    def test_cross_request_cache_is_invalidated_on_participant_change(self):
+        cache.clear()
+        self.client.force_authenticate(self.outsider)
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.assertEqual(self.client.get(url).json()['results'], [])
+        _, queries = self.membership_queries(url)
+        self.assertEqual(queries, 0)
+
+        self.conversation.participants.add(self.outsider)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+
+class BulkMessageTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/bulk/'
+
+    def test_json_array_reports_per_item_errors(self):
+        items = [{'message_body': 'one'}, {'message_body': ''}, {'message_body': 'three'}]
+        response = self.client.post(self.url + '?batch_size=1', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([e['index'] for e in data['errors']], [1])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_preview, 'three')
+
+    def test_ndjson_body(self):
+        body = '{"message_body": "a"}\n\n{"message_body": "b"}\n'
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+
+    def test_outsider_is_rejected(self):
+        self.client.force_authenticate(make_user('outsider@example.com'))
+        response = self.client.post(self.url, [{'message_body': 'x'}], format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class FakeSocket:
+    """Drives the ASGI WebSocket handler in-process."""
+
+    def __init__(self, path, token=None):
+        query = f'token={token}' if token else ''
+        self.scope = {'type': 'websocket', 'path': path, 'query_string': query.encode()}
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+
+    async def connect(self):
+        self.task = asyncio.ensure_future(
+            conversation_socket(self.scope, self.incoming.get, self.outgoing.put)
+        )
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def receive_json(self):
+        event = await asyncio.wait_for(self.outgoing.get(), 5)
+        return json.loads(event['text'])
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+class LiveUpdatesTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/conversations/{self.conversation.pk}/'
+
+    def test_login_issues_tokens_for_custom_user(self):
+        response = APIClient().post(
+            '/api/login/', {'email': 'owner@example.com', 'password': 'pass1234'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+    async def test_rejects_missing_token_and_outsiders(self):
+        event = await FakeSocket(self.path).connect()
+        self.assertEqual(event, {'type': 'websocket.close', 'code': 4401})
+
+        outsider = await sync_to_async(make_user)('outsider@example.com')
+        event = await FakeSocket(self.path, AccessToken.for_user(outsider)).connect()
+        self.assertEqual(event, {'type': 'websocket.close', 'code': 4403})
+
+    async def test_revoked_token_cannot_connect(self):
+        token = AccessToken.for_user(self.other)
+        await sync_to_async(self.other.revoke_tokens)()
+        event = await FakeSocket(self.path, token).connect()
+        self.assertEqual(event, {'type': 'websocket.close', 'code': 4401})
+
+    async def test_removed_participant_is_disconnected(self):
+        socket = FakeSocket(self.path, AccessToken.for_user(self.other))
+        self.assertEqual(await socket.connect(), {'type': 'websocket.accept'})
+        staying = FakeSocket(self.path, AccessToken.for_user(self.user))
+        self.assertEqual(await staying.connect(), {'type': 'websocket.accept'})
+
+        def remove():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.conversation.participants.remove(self.other)
+
+        await sync_to_async(remove)()
+        event = await asyncio.wait_for(socket.outgoing.get(), 5)
+        self.assertEqual(event, {'type': 'websocket.close', 'code': 4403})
+        await asyncio.wait_for(socket.task, 5)
+        # Other participants get no frame for the removal
+        self.assertTrue(staying.outgoing.empty())
+        await staying.disconnect()
+
+    async def test_created_messages_are_pushed_to_participants(self):
+        socket = FakeSocket(self.path, AccessToken.for_user(self.other))
+        self.assertEqual(await socket.connect(), {'type': 'websocket.accept'})
+
+        def post_message():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(f'/api/conversations/{self.conversation.pk}/messages/',
+                            {'message_body': 'live'}, format='json')
+
+        await sync_to_async(post_message)()
+        event = await socket.receive_json()
+        self.assertEqual(event['type'], 'message.created')
+        self.assertEqual(event['message']['message_body'], 'live')
+        await socket.disconnect()
+        self.assertFalse(get_broadcaster().has_subscribers(self.conversation.pk))
+
+
+class AsyncReadViewsTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'm{i}')
+            self.conversation.record_message(message)
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def sync_get(self, path):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(path).json()
+
+    async def test_matches_sync_responses(self):
+        client = AsyncClient()
+        for path in [
+            '/conversations/',
+            f'/conversations/{self.conversation.pk}/',
+            f'/conversations/{self.conversation.pk}/messages/?page_size=2',
+        ]:
+            response = await client.get(f'/api/async{path}', headers=self.auth)
+            self.assertEqual(response.status_code, 200, response.content)
+            expected = await sync_to_async(self.sync_get)(f'/api{path}')
+            data = response.json()
+            if 'next' in data:
+                # Same cursor, different route prefix
+                self.assertEqual(data['next'].replace('/api/async/', '/api/'), expected.pop('next'))
+                data.pop('next')
+            self.assertEqual(data, expected)
+
+    async def test_requires_token_and_membership(self):
+        client = AsyncClient()
+        response = await client.get('/api/async/conversations/')
+        self.assertEqual(response.status_code, 401)
+
+        outsider = await sync_to_async(make_user)('outsider@example.com')
+        auth = {'Authorization': f'Bearer {AccessToken.for_user(outsider)}'}
+        response = await client.get(f'/api/async/conversations/{self.conversation.pk}/', headers=auth)
+        self.assertEqual(response.status_code, 404)
+        response = await client.get(f'/api/async/conversations/{self.conversation.pk}/messages/', headers=auth)
+        self.assertEqual(response.json()['results'], [])
+
+
+class MessagesSinceTest(ParticipantsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversations = []
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.user, self.other])
+            self.conversations.append(conversation)
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def post_message(self, conversation, body):
+        client = APIClient()
+        client.force_authenticate(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(f'/api/conversations/{conversation.pk}/messages/', {'message_body': body}, format='json')
+
+    async def sync(self, **params):
+        response = await AsyncClient().get('/api/messages/since/', params, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_returns_newer_messages_across_conversations(self):
+        await sync_to_async(self.post_message)(self.conversations[0], 'old')
+        cursor = (await self.sync())['cursor']
+        await sync_to_async(self.post_message)(self.conversations[1], 'new-1')
+        await sync_to_async(self.post_message)(self.conversations[0], 'new-2')
+
+        data = await self.sync(since=cursor, limit=1)
+        self.assertEqual([m['message_body'] for m in data['results']], ['new-1'])
+        self.assertTrue(data['has_more'])
+        data = await self.sync(since=data['cursor'])
+        self.assertEqual([m['message_body'] for m in data['results']], ['new-2'])
+        self.assertEqual(data['results'][0]['conversation_id'], str(self.conversations[0].pk))
+        self.assertFalse(data['has_more'])
+
+    async def test_long_poll_wakes_on_new_message(self):
+        await sync_to_async(self.post_message)(self.conversations[0], 'old')
+        cursor = (await self.sync())['cursor']
+        poll = asyncio.ensure_future(self.sync(since=cursor, timeout=5))
+        await asyncio.sleep(0.1)
+        self.assertFalse(poll.done())
+        await sync_to_async(self.post_message)(self.conversations[1], 'live')
+        data = await asyncio.wait_for(poll, 5)
+        self.assertEqual([m['message_body'] for m in data['results']], ['live'])
+
+    async def test_long_poll_queries_again_after_timeout(self):
+        await sync_to_async(self.post_message)(self.conversations[0], 'old')
+        cursor = (await self.sync())['cursor']
+        poll = asyncio.ensure_future(self.sync(since=cursor, timeout=1))
+        await asyncio.sleep(0.1)
+        # Saved without a broadcast, as by another process
+        await Message.objects.acreate(conversation=self.conversations[1], sender=self.other, message_body='quiet')
+        data = await asyncio.wait_for(poll, 5)
+        self.assertEqual([m['message_body'] for m in data['results']], ['quiet'])
+
+    async def test_rejects_bad_cursor(self):
+        response = await AsyncClient().get('/api/messages/since/', {'since': 'nope'}, headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTest(ConversationTestCase):
+    def assert_revalidates(self, url, change):
+        response = self.client.get(url)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def post_message(self, body='hi'):
+        return self.client.post(
+            f'/api/conversations/{self.conversation.pk}/messages/', {'message_body': body}, format='json'
+        ).json()
+
+    def test_inbox(self):
+        self.assert_revalidates('/api/conversations/', self.post_message)
+
+    def test_conversation_detail_tracks_participants(self):
+        url = f'/api/conversations/{self.conversation.pk}/'
+        self.assert_revalidates(url, lambda: self.conversation.participants.add(make_user('new@example.com')))
+
+    def test_message_page_tracks_edits(self):
+        first = self.post_message('first')
+        self.post_message('second')
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.assert_revalidates(url, lambda: self.client.patch(
+            f'{url}{first["message_id"]}/', {'message_body': 'edited'}, format='json'
+        ))
+
+    def test_malformed_ids_are_not_found(self):
+        for url in (
+            '/api/conversations/abc/',
+            '/api/conversations/abc/messages/',
+            f'/api/conversations/{self.conversation.pk}/messages/abc/',
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+
+class FastSerializationTest(TestCase):
+    def setUp(self):
+        self.user = make_user('owner@example.com')
+        self.other = CustomUser.objects.create_user(
+            email='zoë@example.com', password='pass1234', first_name='Zoë',
+            last_name=' Ünïcode', role='host', phone_number='+254700000000',
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.user, self.other])
+        for i, sender in enumerate([self.user, self.other, self.user]):
+            Message.objects.create(
+                conversation=self.conversation, sender=sender,
+                message_body=f'h\u00e9llo \u2028\u2029 \U0001f389 "quoted" {i}',
+            )
+        self.queryset = Message.objects.filter(conversation=self.conversation).select_related(
+            'sender').order_by('sent_at', 'message_id')
+
+    def test_rows_and_renderer_are_byte_identical(self):
+        expected = JSONRenderer().render(MessageSerializer(self.queryset, many=True).data)
+        rows = message_rows(message_values(self.queryset))
+        self.assertEqual(FastJSONRenderer().render(rows), expected)
+        self.assertEqual(JSONRenderer().render(rows), expected)
+
+    def test_raw_datetimes_match_drf_encoding(self):
+        moment = timezone.now().replace(microsecond=123456)
+        data = {'at': moment, 'day': moment.date(), 'time': moment.time(), 'naive': moment.replace(tzinfo=None)}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_stdlib_fallback(self):
+        data = MessageSerializer(self.queryset, many=True).data
+        with mock.patch('chats.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_endpoint_matches_serializer_path(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/conversations/{self.conversation.pk}/messages/?page_size=2'
+        fast = client.get(url).content
+        with override_settings(CHATS_FAST_SERIALIZATION=False):
+            slow = client.get(url).content
+        self.assertEqual(fast, slow)
+
+
+@override_settings(CHATS_EXPORT_CHUNK_SIZE=2)
+class ExportTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'line {i}, "q"')
+        self.url = f'/api/conversations/{self.conversation.pk}/export/'
+
+    def test_ndjson_matches_message_serializer(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).splitlines()
+        expected = MessageSerializer(conversation_messages(self.conversation.pk), many=True).data
+        self.assertEqual([json.loads(line) for line in lines], json.loads(JSONRenderer().render(expected)))
+
+    def test_csv(self):
+        response = self.client.get(self.url + '?as=csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['message_id', 'sent_at', 'sender_id', 'sender_email', 'message_body'])
+        self.assertEqual([r[4] for r in rows[1:]], [f'line {i}, "q"' for i in range(5)])
+
+    def test_outsider_cannot_export(self):
+        self.client.force_authenticate(make_user('outsider@example.com'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class MessageSearchTest(ParticipantsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mine = Conversation.objects.create()
+        self.mine.participants.set([self.user, self.other])
+        self.theirs = Conversation.objects.create()
+        self.theirs.participants.set([self.other])
+
+    def add(self, conversation, body):
+        return Message.objects.create(conversation=conversation, sender=self.other, message_body=body)
+
+    def search(self, **params):
+        response = self.client.get('/api/messages/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def bodies(self, **params):
+        return [m['message_body'] for m in self.search(**params)['results']]
+
+    def test_ranked_and_scoped_to_callers_conversations(self):
+        self.add(self.mine, 'the deploy is done')
+        self.add(self.mine, 'deploy deploy deploy tonight')
+        self.add(self.mine, 'lunch?')
+        self.add(self.theirs, 'secret deploy plans')
+        self.assertEqual(self.bodies(q='deploy'), ['deploy deploy deploy tonight', 'the deploy is done'])
+        self.assertEqual(self.bodies(q='Dépl'), ['deploy deploy deploy tonight', 'the deploy is done'])
+        self.assertEqual(self.bodies(q='"deploy" OR NEAR('), [])
+
+    def test_index_follows_updates_deletes_and_bulk_inserts(self):
+        message = self.add(self.mine, 'draft text')
+        Message.objects.filter(pk=message.pk).update(message_body='final text')
+        self.assertEqual(self.bodies(q='draft'), [])
+        self.assertEqual(self.bodies(q='final'), ['final text'])
+        message.delete()
+        self.assertEqual(self.bodies(q='final'), [])
+        Message.objects.bulk_create(
+            [Message(conversation=self.mine, sender=self.other, message_body=f'bulk {i}') for i in range(3)]
+        )
+        self.assertEqual(len(self.bodies(q='bulk')), 3)
+
+    def test_pagination(self):
+        for i in range(5):
+            self.add(self.mine, f'page item {i}')
+        first = self.search(q='item', limit=3)
+        self.assertEqual(len(first['results']), 3)
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next'])
+
+
+class ReadStateTest(ConversationTestCase):
+    def post_as(self, user, body):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post(
+            f'/api/conversations/{self.conversation.pk}/messages/', {'message_body': body}, format='json'
+        )
+        return response.json()
+
+    def unread(self, user):
+        return ConversationReadState.objects.get(conversation=self.conversation, user=user).unread_count
+
+    def test_counters_follow_messages(self):
+        self.post_as(self.other, 'one')
+        self.post_as(self.other, 'two')
+        self.assertEqual(self.unread(self.user), 2)
+        self.assertEqual(self.unread(self.other), 0)
+
+        # Replying marks everything before the reply as read
+        self.post_as(self.user, 'reply')
+        self.assertEqual(self.unread(self.user), 0)
+        self.assertEqual(self.unread(self.other), 1)
+
+    def test_inbox_unread_count_without_extra_queries(self):
+        for body in ('one', 'two', 'three'):
+            self.post_as(self.other, body)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/conversations/').json()
+        self.assertEqual(data[0]['unread_count'], 3)
+        self.assertLessEqual(len(queries), 4)
+
+    def test_mark_read(self):
+        first = self.post_as(self.other, 'one')
+        self.post_as(self.other, 'two')
+        url = f'/api/conversations/{self.conversation.pk}/read/'
+
+        response = self.client.post(url, {'message_id': first['message_id']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unread_count'], 1)
+        self.assertEqual(response.json()['last_read_message_id'], first['message_id'])
+
+        self.assertEqual(self.client.post(url, format='json').json()['unread_count'], 0)
+        # Moving the position backwards is ignored
+        self.assertEqual(self.client.post(url, {'message_id': first['message_id']}, format='json').json()['unread_count'], 0)
+
+        receipts = self.client.get(f'/api/conversations/{self.conversation.pk}/').json()['read_receipts']
+        self.assertEqual(len(receipts), 2)
+
+    def test_mark_read_changes_etag(self):
+        self.post_as(self.other, 'one')
+        etag = self.client.get('/api/conversations/')['ETag']
+        self.client.post(f'/api/conversations/{self.conversation.pk}/read/', format='json')
+        response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['unread_count'], 0)
+
+    def test_participant_changes_and_deletes(self):
+        self.post_as(self.other, 'before')
+        newcomer = make_user('new@example.com')
+        self.conversation.participants.add(newcomer)
+        # History from before joining is not unread
+        self.assertEqual(self.unread(newcomer), 0)
+
+        latest = self.post_as(self.other, 'after')
+        self.assertEqual(self.unread(newcomer), 1)
+        self.assertEqual(self.unread(self.user), 2)
+
+        client = APIClient()
+        client.force_authenticate(self.other)
+        client.delete(f'/api/conversations/{self.conversation.pk}/messages/{latest["message_id"]}/')
+        self.assertEqual(self.unread(newcomer), 0)
+        self.assertEqual(self.unread(self.user), 1)
+
+        self.conversation.participants.remove(newcomer)
+        self.assertFalse(ConversationReadState.objects.filter(user=newcomer).exists())
+
+
+class CachedAuthenticationTest(TestCase):
+    def setUp(self):
+        get_user_cache().clear()
+        self.user = make_user('owner@example.com')
+        response = APIClient().post(
+            '/api/login/', {'email': 'owner@example.com', 'password': 'pass1234'}, format='json'
+        )
+        self.access = response.json()['access']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return len([q for q in ctx.captured_queries if 'FROM "chats_customuser"' in q['sql']])
+
+    def test_token_carries_claims(self):
+        token = AccessToken(self.access)
+        self.assertEqual(token['role'], 'guest')
+        self.assertEqual(token['tv'], 0)
+
+    def test_user_loaded_once(self):
+        self.assertEqual(self.user_queries(), 1)
+        self.assertEqual(self.user_queries(), 0)
+
+    def test_revocation_and_deactivation(self):
+        self.user_queries()
+        self.user.revoke_tokens()
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 401)
+
+        other = make_user('other@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(other)}')
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+        other.is_active = False
+        other.save()
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 401)
+
+    async def test_async_views_share_cache(self):
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {self.access}'}
+        self.assertEqual((await client.get('/api/async/conversations/', headers=headers)).status_code, 200)
+        await sync_to_async(self.user.revoke_tokens)()
+        self.assertEqual((await client.get('/api/async/conversations/', headers=headers)).status_code, 401)
+
+
+class RefreshRevocationTest(TestCase):
+    def setUp(self):
+        self.user = make_user('owner@example.com')
+        self.client = APIClient()
+        self.tokens = self.client.post(
+            '/api/login/', {'email': 'owner@example.com', 'password': 'pass1234'}, format='json'
+        ).json()
+
+    def refresh(self, token):
+        return self.client.post('/api/refresh/', {'refresh': token}, format='json')
+
+    def test_rotated_token_cannot_be_reused(self):
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    def test_logout_and_revoke_tokens(self):
+        response = self.client.post('/api/logout/', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+
+        tokens = self.client.post(
+            '/api/login/', {'email': 'owner@example.com', 'password': 'pass1234'}, format='json'
+        ).json()
+        self.user.revoke_tokens()
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+    def test_bloom_filter_skips_queries_and_compaction_drops_expired(self):
+        store = RevocationStore()
+        store.revoke('expired', timezone.now() - timedelta(seconds=1))
+        store.revoke('live', timezone.now() + timedelta(days=1))
+        self.assertTrue(store.is_revoked('live'))
+        with self.assertNumQueries(0):
+            self.assertFalse(store.is_revoked('never-revoked'))
+
+        store.compact()
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertFalse(store.is_revoked('expired'))
+        self.assertTrue(store.is_revoked('live'))
+
+
+class PasswordHashingTest(TestCase):
+    def register(self, email):
+        return APIClient().post('/api/register/', {
+            'email': email, 'password': 'pass1234', 'first_name': 'New',
+            'last_name': 'User', 'role': 'guest',
+        }, format='json')
+
+    def login(self, email):
+        return APIClient().post('/api/login/', {'email': email, 'password': 'pass1234'}, format='json')
+
+    @override_settings(CHATS_PASSWORD_HASH_ITERATIONS=1000)
+    def test_cost_is_configurable_and_upgraded_on_login(self):
+        self.assertEqual(self.register('new@example.com').status_code, 201)
+        user = CustomUser.objects.get(email='new@example.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+        with override_settings(CHATS_PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login('new@example.com').status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertEqual(self.login('new@example.com').status_code, 200)
+
+    def test_saturated_pool_fails_fast(self):
+        pool = HashingPool(1, 0)
+        pool.slots.acquire()
+        with mock.patch('chats.hashers.get_hashing_pool', return_value=pool):
+            response = self.register('busy@example.com')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(CustomUser.objects.filter(email='busy@example.com').exists())
+
+
+@override_settings(CHATS_USER_IMPORT_WORKERS=0, CHATS_PASSWORD_HASH_ITERATIONS=1000)
+class UserImportTest(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin@example.com')
+        self.admin.is_staff = True
+        self.admin.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def row(self, email, **extra):
+        return {'email': email, 'first_name': 'New', 'last_name': 'User', 'role': 'guest', **extra}
+
+    def test_ndjson_import_reports_row_errors(self):
+        rows = [
+            self.row('a@example.com', password='secret123'),
+            self.row('b@example.com'),
+            self.row('not-an-email'),
+            self.row('admin@example.com'),
+            self.row('a@example.com'),
+            self.row('c@EXAMPLE.com'),
+        ]
+        body = '\n'.join(json.dumps(r) for r in rows)
+        response = self.client.post('/api/users/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['created'], 3)
+        self.assertEqual([e['index'] for e in data['errors']], [2, 3, 4])
+
+        self.assertTrue(CustomUser.objects.get(email='a@example.com').check_password('secret123'))
+        self.assertFalse(CustomUser.objects.get(email='b@example.com').has_usable_password())
+        self.assertTrue(CustomUser.objects.filter(email='c@example.com').exists())
+
+    def test_csv_import_and_staff_only(self):
+        body = 'email,first_name,last_name,role,password\nd@example.com,D,User,host,\n'
+        response = self.client.post('/api/users/import/', body, content_type='text/csv')
+        self.assertEqual(response.json()['created'], 1)
+
+        self.client.force_authenticate(make_user('plain@example.com'))
+        response = self.client.post('/api/users/import/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_command_hashes_in_worker_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'users.csv'
+        path.write_text(
+            'email,first_name,last_name,role,password\n'
+            'e@example.com,E,User,guest,secret123\n'
+            'f@example.com,F,User,guest,secret456\n'
+        )
+        out = io.StringIO()
+        with mock.patch.dict(os.environ, {'CHATS_PASSWORD_HASH_ITERATIONS': '1000'}):
+            call_command('import_users', str(path), workers=2, stdout=out)
+        self.assertIn('Created 2 users', out.getvalue())
+        self.assertTrue(CustomUser.objects.get(email='f@example.com').check_password('secret456'))
+        # The pool lives only as long as the import
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+class ConversationReuseTest(ParticipantsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.third = make_user('third@example.com')
+
+    def create(self, *users, **extra):
+        return self.client.post(
+            '/api/conversations/', {'participant_ids': [str(u.pk) for u in users], **extra}, format='json'
+        )
+
+    def test_same_participants_reuse_conversation(self):
+        first = self.create(self.user, self.other)
+        self.assertEqual(first.status_code, 201)
+        again = self.create(self.other, self.user)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['conversation_id'], first.json()['conversation_id'])
+        self.assertEqual(self.create(self.user, self.other, self.third).status_code, 201)
+        self.assertEqual(Conversation.objects.count(), 2)
+
+        with self.assertNumQueries(1):
+            conversation, created = Conversation.get_or_create_for([self.user.pk, self.other.pk])
+        self.assertFalse(created)
+
+    def test_opt_out_and_changed_participants(self):
+        first = self.create(self.user, self.other).json()
+        self.assertEqual(self.create(self.user, self.other, reuse_existing=False).status_code, 201)
+
+        conversation = Conversation.objects.get(pk=first['conversation_id'])
+        conversation.participants.add(self.third)
+        conversation.refresh_from_db()
+        self.assertIsNone(conversation.participant_key)
+        # The set it used to have gets a fresh canonical conversation
+        response = self.create(self.user, self.other)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['conversation_id'], first['conversation_id'])
+
+    def test_outsider_does_not_reuse_others_conversation(self):
+        private, _ = Conversation.get_or_create_for([self.other.pk, self.third.pk])
+        response = self.create(self.other, self.third)
+        # The requester joins the new conversation; the private one stays hidden
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['conversation_id'], str(private.pk))
+        conversation = Conversation.objects.get(pk=response.json()['conversation_id'])
+        self.assertEqual(set(conversation.participants.all()), {self.user, self.other, self.third})
+
+
+@override_settings(
+    CHATS_THROTTLE_ENABLED=True,
+    CHATS_THROTTLE_RATES={'message_user': '3/min', 'message_conversation': '4/min', 'auth': '2/min'},
+)
+class ThrottlingTest(ConversationTestCase):
+    def setUp(self):
+        get_token_bucket.cache_clear()
+        throttle_metrics.reset()
+        super().setUp()
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/'
+
+    def post_as(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(self.url, {'message_body': 'hi'}, format='json')
+
+    def test_per_user_and_per_conversation_buckets(self):
+        self.assertEqual([self.post_as(self.user).status_code for _ in range(4)], [201, 201, 201, 429])
+        # Reads are never throttled
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(self.url).status_code, 200)
+        # The other sender has their own bucket, but the conversation's is now empty
+        self.assertEqual(self.post_as(self.other).status_code, 201)
+        response = self.post_as(self.other)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_outsiders_do_not_spend_conversation_tokens(self):
+        outsiders = [make_user(f'outsider{i}@example.com') for i in range(2)]
+        self.assertEqual([self.post_as(outsiders[i % 2]).status_code for i in range(6)], [403] * 6)
+        self.assertEqual([self.post_as(self.user).status_code for _ in range(3)], [201, 201, 201])
+
+    def test_bulk_requests_spend_one_token_per_message(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        bulk = f'{self.url}bulk/'
+        self.assertEqual(client.post(bulk, [{'message_body': 'a'}] * 2, format='json').status_code, 201)
+        # One of the sender's three tokens is left; the second refills in 20s
+        response = client.post(bulk, [{'message_body': 'a'}] * 2, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual([self.post_as(self.user).status_code for _ in range(2)], [201, 429])
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_bulk_larger_than_the_bucket_empties_a_full_one(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'{self.url}bulk/', [{'message_body': 'a'}] * 10, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Message.objects.count(), 10)
+        response = self.post_as(self.user)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_rejected_requests_give_back_tokens(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(f'{self.url}bulk/', [{'message_body': 'a'}] * 4, format='json').status_code, 201)
+        # The conversation's bucket is empty, so the other sender's own
+        # tokens are returned each time
+        self.assertEqual([self.post_as(self.other).status_code for _ in range(5)], [429] * 5)
+        self.assertTrue(get_token_bucket().consume(f'message_user:{self.other.pk}', 3, 60, 3)[0])
+
+    def test_auth_throttle_and_metrics(self):
+        client = APIClient()
+        statuses = [
+            client.post('/api/login/', {'email': 'owner@example.com', 'password': 'wrong'}, format='json').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [401, 401, 429])
+
+        admin = make_user('admin@example.com')
+        admin.is_staff = True
+        admin.save()
+        client.force_authenticate(admin)
+        self.assertEqual(client.get('/api/metrics/throttling/').json()['auth'], {'allowed': 2, 'rejected': 1})
+
+    def test_auth_throttle_ignores_forwarded_for(self):
+        client = APIClient()
+        statuses = [
+            client.post(
+                '/api/login/', {'email': 'owner@example.com', 'password': 'wrong'}, format='json',
+                HTTP_X_FORWARDED_FOR=f'203.0.113.{i}',
+            ).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [401, 401, 429])
+
+    def test_buckets_refill(self):
+        bucket = LocalTokenBucket()
+        with mock.patch('chats.throttling.time.monotonic', return_value=1000.0):
+            self.assertEqual([bucket.consume('k', 2, 60)[0] for _ in range(3)], [True, True, False])
+        with mock.patch('chats.throttling.time.monotonic', return_value=1030.0):
+            self.assertEqual([bucket.consume('k', 2, 60)[0] for _ in range(2)], [True, False])
+
+
+class SQLiteTuningTest(TestCase):
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            # 1 is NORMAL; journal_mode stays "memory" for the in-memory test database
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA temp_store').fetchone()[0], 2)
+
+
+class ImmediateTransactionTest(TransactionTestCase):
+    def test_atomic_begins_immediate(self):
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            CustomUser.objects.exists()
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+
+@override_settings(CHATS_READ_REPLICAS=['replica'])
+class ReplicaRoutingTest(TransactionTestCase):
+    # Routing is only checked here, so 'replica' never needs to exist.
+    # TestCase would not do: reads inside a transaction stay on the primary
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(Conversation.objects.all().db, 'default')
+
+    def test_request_reads(self):
+        with routing_state():
+            self.assertEqual(Conversation.objects.all().db, 'replica')
+            self.assertEqual(CustomUser.objects.all().db, 'replica')
+            # Only the routed models go to replicas
+            self.assertEqual(ConversationReadState.objects.all().db, 'default')
+            with transaction.atomic():
+                self.assertEqual(Message.objects.all().db, 'default')
+            # Once the request writes, the rest of it reads from the primary
+            router.db_for_write(Message)
+            self.assertEqual(Message.objects.all().db, 'default')
+        with routing_state(primary=True):
+            self.assertEqual(Message.objects.all().db, 'default')
+
+    def test_writers_stick_to_primary(self):
+        with routing_state() as state:
+            identify('writer')
+            router.db_for_write(Message)
+        self.assertTrue(state.wrote)
+        record_write(state)
+
+        with routing_state():
+            identify('writer')
+            self.assertEqual(Message.objects.all().db, 'default')
+        with routing_state():
+            identify('someone-else')
+            self.assertEqual(Message.objects.all().db, 'replica')
+        # The window has passed
+        with mock.patch('chats.routers.time.time', return_value=time.time() + 10), routing_state():
+            identify('writer')
+            self.assertEqual(Message.objects.all().db, 'replica')
+
+    @override_settings(CHATS_READ_REPLICAS=['default'])
+    def test_api_reads_after_write(self):
+        # The primary stands in for its replica; what matters is whether the
+        # replica path was taken
+        user, other = make_user('owner@example.com'), make_user('other@example.com')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(user, other)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        url = f'/api/conversations/{conversation.pk}/messages/'
+
+        with mock.patch('chats.routers.random.choice', return_value='default') as choice:
+            self.assertEqual(client.get(url).status_code, 200)
+            self.assertEqual(choice.call_count, 1)
+            self.assertEqual(client.post(url, {'message_body': 'hi'}, format='json').status_code, 201)
+            self.assertEqual(client.get(url).json()['results'][0]['message_body'], 'hi')
+            self.assertEqual(choice.call_count, 1)
+
+            other_client = APIClient()
+            other_client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(other)}')
+            self.assertEqual(other_client.get(url).status_code, 200)
+            self.assertEqual(choice.call_count, 2)
+
+
+
+class MessageArchiveTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=400)
+        for i in range(10):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, message_body=f'm{i}')
+            if i < 8:
+                Message.objects.filter(pk=message.pk).update(sent_at=old + timedelta(seconds=i))
+            self.conversation.record_message(message)
+        # The other participant has read up to m1, so that one stays hot
+        message = Message.objects.get(message_body='m1')
+        ConversationReadState.objects.get(user=self.other).mark_read(message)
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.before = self.page_through()
+
+    def archive(self):
+        out = io.StringIO()
+        call_command('archive_messages', '--batch-size', '3', stdout=out)
+        return out.getvalue()
+
+    def page_through(self, page_size=3):
+        bodies, url = [], f'{self.url}?page_size={page_size}'
+        while url:
+            data = self.client.get(url).json()
+            bodies += [m['message_body'] for m in data['results']]
+            url = data['next']
+        return bodies
+
+    def test_archives_old_unreferenced_messages(self):
+        self.assertIn('Archived 7 messages', self.archive())
+        self.assertEqual(
+            sorted(Message.objects.values_list('message_body', flat=True)), ['m1', 'm8', 'm9']
+        )
+        self.assertEqual(ArchivedMessage.objects.count(), 7)
+        self.assertIn('Archived 0 messages', self.archive())
+
+    def test_deleting_latest_restores_newest_archived_message(self):
+        self.archive()
+        for body in ('m9', 'm8'):
+            message = Message.objects.get(message_body=body)
+            self.assertEqual(self.client.delete(f'{self.url}{message.pk}/').status_code, 204)
+        # m7 is newer than the hot m1, so it comes back to be last_message
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message.message_body, 'm7')
+        self.assertEqual(self.conversation.last_message_preview, 'm7')
+        self.assertEqual(self.conversation.message_count, 8)
+        self.assertFalse(ArchivedMessage.objects.filter(message_body='m7').exists())
+        self.assertEqual(self.page_through(), self.before[:8])
+
+    def test_reads_go_through_to_the_archive(self):
+        self.archive()
+        self.assertEqual(self.before, [f'm{i}' for i in range(10)])
+        self.assertEqual(self.page_through(), self.before)
+        self.assertEqual(self.page_through(page_size=50), self.before)
+        with self.settings(CHATS_FAST_SERIALIZATION=False):
+            self.assertEqual(self.page_through(), self.before)
+
+        archived = ArchivedMessage.objects.get(message_body='m0')
+        detail = self.client.get(f'{self.url}{archived.pk}/')
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()['message_body'], 'm0')
+
+        export = b''.join(self.client.get(f'/api/conversations/{self.conversation.pk}/export/').streaming_content)
+        self.assertEqual([json.loads(line)['message_body'] for line in export.splitlines()], self.before)
+
+    async def test_sync_reads_archived_messages(self):
+        await sync_to_async(self.archive)()
+        first = await Message.objects.aget(message_body='m1')
+        auth = {'Authorization': f'Bearer {AccessToken.for_user(self.other)}'}
+        response = await AsyncClient().get(
+            '/api/messages/since/', {'since': encode_sync_cursor(first), 'limit': 3}, headers=auth
+        )
+        self.assertEqual([m['message_body'] for m in response.json()['results']], ['m2', 'm3', 'm4'])
+
+    def test_counts_include_archived_messages(self):
+        self.archive()
+        state = ConversationReadState.objects.get(user=self.other)
+        self.assertEqual(state.unread_count, 8)
+        ConversationReadState.recount(self.conversation)
+        state.refresh_from_db()
+        self.assertEqual(state.unread_count, 8)
+
+        archived = ArchivedMessage.objects.get(message_body='m5')
+        self.assertEqual(self.client.delete(f'{self.url}{archived.pk}/').status_code, 204)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 9)
+        state.refresh_from_db()
+        self.assertEqual(state.unread_count, 7)
+
+
+
+class MessageCompressionTest(ConversationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/'
+        self.large = 'payload ' + 'lorem ipsum dolor sit amet ' * 200 + 'needle'
+
+    def stored_type(self, message_id):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT typeof(message_body) FROM chats_message WHERE message_id = %s', [message_id.hex])
+            return cursor.fetchone()[0]
+
+    def post(self, body):
+        response = self.client.post(self.url, {'message_body': body}, format='json')
+        return uuid.UUID(response.json()['message_id'])
+
+    def test_large_bodies_are_stored_compressed(self):
+        large, small = self.post(self.large), self.post('hello')
+        self.assertEqual(self.stored_type(large), 'blob')
+        self.assertEqual(self.stored_type(small), 'text')
+
+        # Decompressed on first access only
+        message = Message.objects.get(pk=large)
+        self.assertIsInstance(message.__dict__['message_body'], bytes)
+        self.assertEqual(message.message_body, self.large)
+        self.assertIsInstance(message.__dict__['message_body'], str)
+
+        for fast in (True, False):
+            with self.settings(CHATS_FAST_SERIALIZATION=fast):
+                bodies = [m['message_body'] for m in self.client.get(self.url).json()['results']]
+            self.assertEqual(bodies, [self.large, 'hello'])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_preview, 'hello')
+
+        results = self.client.get('/api/messages/search/', {'q': 'needle'}).json()['results']
+        self.assertEqual([r['message_id'] for r in results], [str(large)])
+
+    def test_stock_sqlite_engine_gets_body_function(self):
+        stock = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': ':memory:', 'OPTIONS': {}}, alias='stock')
+        try:
+            with stock.cursor() as cursor:
+                cursor.execute('SELECT chats_body_text(%s)', [compress_body(self.large)])
+                self.assertEqual(cursor.fetchone()[0], self.large)
+        finally:
+            stock.close()
+
+    def test_compress_messages_command(self):
+        with self.settings(CHATS_MESSAGE_COMPRESSION_THRESHOLD=10**9):
+            plain = self.post(self.large)
+        self.assertEqual(self.stored_type(plain), 'text')
+        out = io.StringIO()
+        call_command('compress_messages', stdout=out)
+        self.assertIn('Compressed 1 messages', out.getvalue())
+        self.assertEqual(self.stored_type(plain), 'blob')
+        self.assertEqual(Message.objects.get(pk=plain).message_body, self.large)
+        # Still searchable after the rewrite
+        results = self.client.get('/api/messages/search/', {'q': 'needle'}).json()['results']
+        self.assertEqual(len(results), 1)
+
+
+@override_settings(CHATS_INSTRUMENTATION_SAMPLE_RATE=1, CHATS_SERVER_TIMING=True)
+class InstrumentationTest(ConversationTestCase):
+    def setUp(self):
+        registry.reset()
+        super().setUp()
+        Message.objects.create(conversation=self.conversation, sender=self.user, message_body='hello')
+        self.url = f'/api/conversations/{self.conversation.pk}/messages/'
+
+    def metric(self, text, line_start):
+        return [line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(line_start)]
+
+    def test_sampled_requests_are_measured(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        # Read it now: the next request resets the connection's query log
+        query_count = len(queries)
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", ser;dur=[\d.]+, total;dur=')
+        self.assertIn(f'desc="{query_count} queries"', response['Server-Timing'])
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        labels = '{endpoint="conversation-messages-list",method="GET"'
+        self.assertEqual(self.metric(text, f'chats_http_requests_total{labels}}}'), ['1'])
+        self.assertEqual(self.metric(text, f'chats_db_queries_sum{labels}}}'), [str(query_count)])
+        self.assertEqual(self.metric(text, f'chats_response_size_bytes_bucket{labels},le="256"}}'), ['0'])
+        self.assertEqual(self.metric(text, f'chats_response_size_bytes_bucket{labels},le="1024"}}'), ['1'])
+        self.assertGreater(float(self.metric(text, f'chats_serialization_duration_seconds_sum{labels}}}')[0]), 0)
+        self.assertIn('# TYPE chats_throttle_requests_total counter', text)
+
+    def test_unsampled_requests_are_only_counted(self):
+        with self.settings(CHATS_INSTRUMENTATION_SAMPLE_RATE=0):
+            response = self.client.get(self.url)
+            self.client.get('/api/no-such-route/')
+        self.assertNotIn('Server-Timing', response)
+        text = registry.render()
+        self.assertIn('chats_http_requests_total{endpoint="conversation-messages-list",method="GET"} 1', text)
+        self.assertIn('chats_http_requests_total{endpoint="unmatched",method="GET"} 1', text)
+        self.assertNotIn('chats_db_queries_count', text)
+
+    def test_nonstandard_methods_share_one_label(self):
+        for method in ('FOO', 'BAR'):
+            self.client.generic(method, self.url)
+        text = registry.render()
+        self.assertIn('chats_http_requests_total{endpoint="conversation-messages-list",method="OTHER"} 2', text)
+        self.assertNotIn('FOO', text)
+
+    async def test_async_views_are_measured(self):
+        response = await AsyncClient().get(
+            f'/api/async/conversations/{self.conversation.pk}/messages/',
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    def test_metrics_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
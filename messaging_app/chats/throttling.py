@@ -0,0 +1,208 @@
+"""
+Token-bucket throttling for message creation and the auth endpoints.
+
+Rates come from CHATS_THROTTLE_RATES as "<requests>/<period>" (period s, m,
+h or d): a bucket holds that many requests and refills over the period, so
+bursts up to the full amount are allowed. A bulk message request costs
+one token per message, capped at the capacity so a request larger than
+the bucket needs a full one and empties it. When a later throttle
+rejects a request, the tokens earlier throttles took for it are given
+back. Buckets are kept as a single
+"theoretical arrival time" per key (GCRA), which needs no lock: concurrent
+requests for the same key can at worst let one extra request through.
+
+The bucket store is chosen by CHATS_THROTTLE_BACKEND. LocalTokenBucket
+keeps buckets in this process; CacheTokenBucket keeps them in the Django
+cache so several processes share limits (point CACHES at Redis or
+Memcached in production).
+"""
+import functools
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+from .permissions import is_participant
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'30/min' -> (30, 60.0)"""
+    count, period = rate.split('/')
+    return int(count), float(PERIODS[period[0]])
+
+
+class TokenBucket:
+    """Interface for bucket stores."""
+
+    def consume(self, key, capacity, period, tokens=1):
+        """Take tokens; return (allowed, seconds until they are available)."""
+        raise NotImplementedError
+
+    def refund(self, key, capacity, period, tokens=1):
+        """Give back tokens taken by consume for a request that was rejected later."""
+        raise NotImplementedError
+
+    @staticmethod
+    def advance(tat, now, capacity, period, tokens=1):
+        # tat is when the bucket would be full again; a request fits while
+        # the new tat stays within one period of now. tokens must not
+        # exceed capacity, or the request could never fit
+        new_tat = max(tat or now, now) + period * tokens / capacity
+        if new_tat - period > now:
+            return None, new_tat - period - now
+        return new_tat, 0
+
+
+class LocalTokenBucket(TokenBucket):
+    max_keys = 100000
+
+    def __init__(self):
+        self._tats = {}
+
+    def consume(self, key, capacity, period, tokens=1):
+        now = time.monotonic()
+        new_tat, wait = self.advance(self._tats.get(key), now, capacity, period, tokens)
+        if new_tat is None:
+            return False, wait
+        self._tats[key] = new_tat
+        if len(self._tats) > self.max_keys:
+            self._prune(now)
+        return True, 0
+
+    def refund(self, key, capacity, period, tokens=1):
+        if key in self._tats:
+            self._tats[key] -= period * tokens / capacity
+
+    def _prune(self, now):
+        # A bucket whose tat has passed is full, the same as no entry
+        for key, tat in list(self._tats.items()):
+            if tat <= now:
+                self._tats.pop(key, None)
+
+
+class CacheTokenBucket(TokenBucket):
+    cache_alias = 'default'
+
+    def consume(self, key, capacity, period, tokens=1):
+        cache = caches[self.cache_alias]
+        now = time.time()
+        cache_key = f'chats:throttle:{key}'
+        new_tat, wait = self.advance(cache.get(cache_key), now, capacity, period, tokens)
+        if new_tat is None:
+            return False, wait
+        cache.set(cache_key, new_tat, timeout=int(new_tat - now) + 1)
+        return True, 0
+
+    def refund(self, key, capacity, period, tokens=1):
+        cache = caches[self.cache_alias]
+        cache_key = f'chats:throttle:{key}'
+        tat = cache.get(cache_key)
+        if tat is not None:
+            tat -= period * tokens / capacity
+            cache.set(cache_key, tat, timeout=max(int(tat - time.time()), 0) + 1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_bucket():
+    return import_string(settings.CHATS_THROTTLE_BACKEND)()
+
+
+class ThrottleMetrics:
+    """Allowed and rejected request counts per throttle scope."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {'allowed': 0, 'rejected': 0})
+
+    def record(self, scope, allowed):
+        with self._lock:
+            self._counts[scope]['allowed' if allowed else 'rejected'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {scope: dict(counts) for scope, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+metrics = ThrottleMetrics()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def get_cost(self, request, view):
+        # Views that create several things per request (bulk) charge one
+        # token per item through get_throttle_cost; allow_request caps it
+        # at the capacity
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        return get_throttle_cost(request) if get_throttle_cost else 1
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        rate = settings.CHATS_THROTTLE_RATES.get(self.scope)
+        # DRF runs every throttle; once one has rejected the request the
+        # rest must not spend tokens on it
+        if not settings.CHATS_THROTTLE_ENABLED or rate is None or getattr(request, '_throttled', False):
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        capacity, period = parse_rate(rate)
+        charge = (f'{self.scope}:{key}', capacity, period, min(self.get_cost(request, view), capacity))
+        bucket = get_token_bucket()
+        allowed, self.wait_time = bucket.consume(*charge)
+        metrics.record(self.scope, allowed)
+        charges = getattr(request, '_throttle_charges', None)
+        if charges is None:
+            charges = request._throttle_charges = []
+        if allowed:
+            charges.append(charge)
+        else:
+            # The request is not served, so what earlier throttles took
+            # for it goes back
+            for earlier in charges:
+                bucket.refund(*earlier)
+            charges.clear()
+            request._throttled = True
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class MessageUserThrottle(TokenBucketThrottle):
+    scope = 'message_user'
+
+    def get_key(self, request, view):
+        return request.user.pk if request.user.is_authenticated else None
+
+
+class MessageConversationThrottle(TokenBucketThrottle):
+    scope = 'message_conversation'
+
+    def get_key(self, request, view):
+        # Throttles run before the view's membership check; only members
+        # spend the conversation's tokens, so outsiders cannot exhaust it
+        # (they still spend their own message_user tokens)
+        conversation_id = view.kwargs.get('conversation_pk')
+        if conversation_id is None or not is_participant(request, conversation_id):
+            return None
+        return conversation_id
+
+
+class AuthThrottle(TokenBucketThrottle):
+    scope = 'auth'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
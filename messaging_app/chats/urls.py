@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework_nested import routers as rts
-from .views import ConversationViewSet, MessageViewSet
-from .auth import RegisterView, LoginView, RefreshView
+from .views import ConversationViewSet, MessageViewSet, MessageSearchView, MetricsView, ThrottleMetricsView
+from .auth import RegisterView, LoginView, LogoutView, RefreshView, UserImportView
+from . import async_views
 
 con = 'conversation'
 # DRF routers
@@ -16,6 +17,19 @@ urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),
     path("login/", LoginView, name="login"),
     path("refresh/", RefreshView, name="token_refresh"),
+    path("logout/", LogoutView.as_view(), name="logout"),
+    path("users/import/", UserImportView.as_view(), name="users-import"),
+    # ASGI-native read-only mirrors of the conversation/message list and detail routes
+    path('async/conversations/', async_views.conversation_list, name='async-conversation-list'),
+    path('async/conversations/<uuid:pk>/', async_views.conversation_detail, name='async-conversation-detail'),
+    path('async/conversations/<uuid:conversation_pk>/messages/', async_views.message_list,
+         name='async-conversation-messages-list'),
+    path('async/conversations/<uuid:conversation_pk>/messages/<uuid:pk>/', async_views.message_detail,
+         name='async-conversation-messages-detail'),
+    path('messages/since/', async_views.messages_since, name='messages-since'),
+    path('messages/search/', MessageSearchView.as_view(), name='messages-search'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/throttling/', ThrottleMetricsView.as_view(), name='throttle-metrics'),
     path('', include(router.urls)),
     path('', include(conrts.urls)),
 ]
@@ -0,0 +1,164 @@
+"""
+Bulk user import from CSV or NDJSON, for onboarding a whole organisation.
+
+Rows are handled in batches: each row is validated with
+UserImportSerializer, email uniqueness is checked with one query per batch,
+passwords are hashed on worker processes started for the import and
+stopped when it ends, and the batch is saved
+with a single bulk_create. Rows without a password are invitations and get
+an unusable password until the user sets one. Invalid rows are reported by
+their index and never stop the rest of the import.
+
+Used by the import_users management command and POST /api/users/import/.
+"""
+import csv
+import json
+import multiprocessing
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, make_password
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+from .models import CustomUser
+from .serializers import UserImportSerializer
+
+FORMATS = ('csv', 'ndjson')
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    errors: list = field(default_factory=list)
+
+    def error(self, index, errors):
+        self.errors.append({'index': index, 'errors': errors})
+
+
+def parse_rows(stream, fmt):
+    """Yield one dict per row from a text stream in the given format."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'ndjson':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Reported against the row like any other invalid input
+                yield None
+    else:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+
+
+class HashingProcesses:
+    """
+    Password hashing for one import: a process pool started on first use
+    and shut down when the import ends, so no idle workers outlive it.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def hash(self, passwords):
+        if not self.workers or len(passwords) < 2:
+            return [make_password(p) for p in passwords]
+        if self.executor is None:
+            # spawn rather than fork, as the parent may already be running
+            # threads. Workers only need settings and the hashers
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def _save_batch(batch, result, batch_size):
+    """Insert (index, user) pairs, dropping rows whose email was taken meanwhile."""
+    try:
+        with transaction.atomic():
+            CustomUser.objects.bulk_create([user for _, user in batch], batch_size=batch_size)
+        result.created += len(batch)
+    except IntegrityError:
+        # Someone else created some of these emails since the batch was checked
+        taken = set(CustomUser.objects.filter(
+            email__in=[user.email for _, user in batch]
+        ).values_list('email', flat=True))
+        for index, user in batch:
+            if user.email in taken:
+                result.error(index, {'email': ['A user with this email already exists.']})
+        remaining = [(index, user) for index, user in batch if user.email not in taken]
+        if remaining:
+            with transaction.atomic():
+                CustomUser.objects.bulk_create([user for _, user in remaining], batch_size=batch_size)
+            result.created += len(remaining)
+
+
+def import_batch(rows, result, hashing, batch_size):
+    """Validate, hash and insert one batch of (index, row) pairs."""
+    # One serializer for the whole batch: building a ModelSerializer's
+    # fields costs far more than validating a row with them
+    serializer = UserImportSerializer()
+    valid = []
+    for index, row in rows:
+        if not isinstance(row, dict):
+            result.error(index, {'non_field_errors': ['Expected an object.']})
+            continue
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except ValidationError as exc:
+            result.error(index, exc.detail)
+
+    emails = [data['email'] for _, data in valid]
+    taken = set(CustomUser.objects.filter(email__in=emails).values_list('email', flat=True))
+    batch, seen = [], set()
+    for index, data in valid:
+        if data['email'] in taken or data['email'] in seen:
+            result.error(index, {'email': ['A user with this email already exists.']})
+            continue
+        seen.add(data['email'])
+        batch.append((index, data))
+
+    users = []
+    passwords = [data.pop('password', None) for _, data in batch]
+    hashed = hashing.hash([p for p in passwords if p])
+    hashed.reverse()
+    for (index, data), password in zip(batch, passwords):
+        user = CustomUser(**data)
+        # Same format as set_unusable_password, without its slow random string
+        user.password = hashed.pop() if password else UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20)
+        users.append((index, user))
+    if users:
+        _save_batch(users, result, batch_size)
+
+
+def import_users(rows, batch_size=None, workers=None):
+    """Import an iterable of row dicts; returns an ImportResult."""
+    batch_size = batch_size or settings.CHATS_USER_IMPORT_BATCH_SIZE
+    workers = settings.CHATS_USER_IMPORT_WORKERS if workers is None else workers
+    result = ImportResult()
+    batch = []
+    with HashingProcesses(workers) as hashing:
+        for index, row in enumerate(rows):
+            batch.append((index, row))
+            if len(batch) == batch_size:
+                import_batch(batch, result, hashing, batch_size)
+                batch = []
+        if batch:
+            import_batch(batch, result, hashing, batch_size)
+    result.errors.sort(key=lambda error: error['index'])
+    return result
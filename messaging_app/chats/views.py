@@ -1,51 +1,319 @@
-from rest_framework import viewsets, permissions
+import uuid
+from rest_framework import generics, viewsets, permissions, status
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import action
-from django.shortcuts import get_object_or_404
-from .models import Conversation, Message, CustomUser
+from django.conf import settings
+from django.db import transaction
+from rest_framework.generics import get_object_or_404
+from .models import Conversation, ConversationReadState, Message, CustomUser
 from .serializers import (
     ConversationSerializer,
     ConversationCreateSerializer,
+    ConversationInboxSerializer,
+    MarkReadSerializer,
     MessageSerializer,
+    ReadReceiptSerializer,
+    MessageSyncSerializer,
+    message_rows,
+    message_values,
 )
 from rest_framework.exceptions import PermissionDenied
-from .permissions import IsParticipantOfConversation as ipoc
+from .permissions import IsParticipantOfConversation as ipoc, is_participant
+from .pagination import MessageCursorPagination
+from .mixins import ConditionalGetMixin, make_etag
+from .parsers import NDJSONParser
+from .realtime import broadcast_messages
+from .queries import conversation_history, user_conversation_details, user_conversations
+from .exports import csv_stream, ndjson_stream
+from .search import get_search_backend
+from .throttling import MessageConversationThrottle, MessageUserThrottle, metrics as throttle_metrics
+from .instrumentation import escape, registry
+from .renderers import PrometheusTextRenderer
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Conversation.objects.all()
     permission_classes = [permissions.IsAuthenticated, ipoc]
 
     def get_serializer_class(self):
         if self.action == 'create':
             return ConversationCreateSerializer
+        if self.action == 'list':
+            return ConversationInboxSerializer
         return ConversationSerializer
 
     def get_queryset(self):
         # Return only conversations the user is a participant in
-        return self.queryset.filter(participants=self.request.user)
+        if self.action == 'list':
+            return user_conversations(self.request.user)
+        return user_conversation_details(self.request.user)
 
-    def perform_create(self, serializer):
+    def get_etag(self, request):
+        # The caller's unread count is part of the representation too
+        versions = user_conversations(request.user).prefetch_related(None).values_list(
+            'conversation_id', 'version', 'unread_count'
+        )
+        if self.action == 'list':
+            return make_etag('inbox', list(versions))
+        try:
+            pk = uuid.UUID(self.kwargs['pk'])
+        except ValueError:
+            # Left to get_object to answer 404
+            return None
+        version = versions.filter(pk=pk).first()
+        return make_etag('conversation', version) if version else None
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         serializer.save()
+        # 200 when an existing conversation for the same participants is reused
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """
+        Mark the conversation read up to message_id (default: the latest
+        message). Returns the caller's read receipt and unread count.
+        """
+        conversation = self.get_object()
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message_id = serializer.validated_data.get('message_id')
+        if message_id is not None:
+            message = get_object_or_404(Message, pk=message_id, conversation=conversation)
+        else:
+            message = conversation.last_message
+
+        with transaction.atomic():
+            state, _ = ConversationReadState.objects.select_for_update().get_or_create(
+                conversation=conversation, user=request.user
+            )
+            # Read receipts are part of the conversation representation
+            if message is not None and state.mark_read(message):
+                conversation.bump_version()
+        return Response({**ReadReceiptSerializer(state).data, 'unread_count': state.unread_count})
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream the conversation's full history as NDJSON (default) or CSV
+        (?as=csv). Memory use does not grow with the number of messages.
+        """
+        conversation = self.get_object()
+        kind = request.query_params.get('as', 'ndjson')
+        if kind == 'csv':
+            stream, content_type = csv_stream(conversation.pk), 'text/csv; charset=utf-8'
+        elif kind == 'ndjson':
+            stream, content_type = ndjson_stream(conversation.pk), 'application/x-ndjson'
+        else:
+            return Response({'detail': 'as must be ndjson or csv.'}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="conversation-{conversation.pk}.{kind}"'
+        return response
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, ipoc]
+    pagination_class = MessageCursorPagination
+
+    def get_throttles(self):
+        # Only writes are throttled: per sender and per conversation
+        if self.action in ('create', 'bulk'):
+            return [MessageUserThrottle(), MessageConversationThrottle()]
+        return super().get_throttles()
+
+    def get_throttle_cost(self, request):
+        # A bulk request spends one token per message it carries
+        if self.action == 'bulk' and isinstance(request.data, list):
+            return max(len(request.data), 1)
+        return 1
 
     def get_queryset(self):
         conversation_id = self.kwargs.get('conversation_pk')
-        conversation = get_object_or_404(Conversation, pk=conversation_id)
 
-        # Ensure user is part of the conversation
-        if self.request.user not in conversation.participants.all():
+        # Ensure user is part of the conversation (memoized for this request,
+        # so the object permission check below does not query again)
+        if not is_participant(self.request, conversation_id):
+            get_object_or_404(Conversation, pk=conversation_id)
             return Message.objects.none()
 
-        return conversation.messages.all().order_by('sent_at')
+        # Pages and lookups read through to archived messages
+        return conversation_history(conversation_id)
 
-    def perform_create(self, serializer):
+    def list(self, request, *args, **kwargs):
+        if not settings.CHATS_FAST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        return self.conditional(self.fast_list, request, *args, **kwargs)
+
+    def fast_list(self, request, *args, **kwargs):
+        # Cursor pagination reads its position from dict rows as well as
+        # model instances, so the page can be fetched as values() rows
+        queryset = message_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(message_rows(page))
+
+    def get_etag(self, request):
         conversation_id = self.kwargs.get('conversation_pk')
-        conversation = get_object_or_404(Conversation, pk=conversation_id)
+        if not is_participant(request, conversation_id):
+            return None
+        version = Conversation.objects.filter(pk=conversation_id).values_list('version', flat=True).first()
+        if version is None:
+            return None
+        # The page (cursor, page size) or message is part of the URL
+        return make_etag('messages', conversation_id, version, request.get_full_path())
 
-        if self.request.user not in conversation.participants.all():
+    def get_conversation(self):
+        """Fetch the parent conversation, requiring the user to be in it."""
+        conversation_id = self.kwargs.get('conversation_pk')
+        conversation = get_object_or_404(Conversation, pk=conversation_id)
+        if not is_participant(self.request, conversation_id):
             raise PermissionDenied("You are not part of this conversation.")
+        return conversation
+
+    def perform_create(self, serializer):
+        conversation = self.get_conversation()
+        with transaction.atomic():
+            message = serializer.save(conversation=conversation, sender=self.request.user)
+            conversation.record_message(message)
+            broadcast_messages(conversation, [message])
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            message = serializer.save()
+            if message.conversation.last_message_id == message.pk:
+                message.conversation.refresh_last_message()
+            else:
+                message.conversation.bump_version()
+
+    def perform_destroy(self, instance):
+        conversation = instance.conversation
+        with transaction.atomic():
+            instance.delete()
+            conversation.refresh_last_message()
+            ConversationReadState.recount(conversation)
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request, conversation_pk=None):
+        """
+        Create many messages at once from a JSON array or NDJSON body.
+        Membership is checked once, valid items are inserted with
+        bulk_create inside one transaction, and invalid items are reported
+        by their index without aborting the rest.
+        """
+        conversation = self.get_conversation()
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of messages.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_items = settings.CHATS_BULK_MESSAGE_MAX_ITEMS
+        if len(items) > max_items:
+            return Response(
+                {'detail': f'At most {max_items} messages per request.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        batch_size = settings.CHATS_BULK_MESSAGE_BATCH_SIZE
+        if 'batch_size' in request.query_params:
+            try:
+                batch_size = max(1, min(int(request.query_params['batch_size']), max_items))
+            except ValueError:
+                return Response({'detail': 'batch_size must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        messages, errors = [], []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                messages.append(Message(
+                    conversation=conversation, sender=request.user, **serializer.validated_data
+                ))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        if messages:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages, batch_size=batch_size)
+                conversation.record_message(messages[-1], count=len(messages))
+                broadcast_messages(conversation, messages)
+
+        return Response(
+            {'created': len(messages), 'message_ids': [m.message_id for m in messages], 'errors': errors},
+            status=status.HTTP_201_CREATED if messages else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class MessageSearchView(generics.GenericAPIView):
+    """
+    Full-text search over the caller's messages, best match first.
+    Optional ?conversation=<id> narrows to one conversation; paginate with
+    ?limit= and ?offset= (follow "next").
+    """
+    serializer_class = MessageSyncSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'q is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({'detail': 'limit and offset must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        conversation_ids = Conversation.participants.through.objects.filter(
+            customuser_id=request.user.pk
+        ).values_list('conversation_id', flat=True)
+        if 'conversation' in request.query_params:
+            try:
+                conversation_ids = conversation_ids.filter(
+                    conversation_id=uuid.UUID(request.query_params['conversation'])
+                )
+            except ValueError:
+                return Response({'detail': 'conversation must be a UUID.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = get_search_backend().search(list(conversation_ids), query, limit + 1, offset)
+        has_more = len(ids) > limit
+        ids = [uuid.UUID(str(i)) for i in ids[:limit]]
+        found = Message.objects.select_related('sender').in_bulk(ids)
+        messages = [found[i] for i in ids if i in found]
+
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', offset + limit)
+        return Response({'next': next_url, 'results': self.get_serializer(messages, many=True).data})
+
+
+class ThrottleMetricsView(generics.GenericAPIView):
+    """Allowed and rejected request counts per throttle scope (staff only)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(throttle_metrics.snapshot())
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    Per-endpoint request metrics (chats.instrumentation) and throttle
+    counts in the Prometheus text format (staff only).
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusTextRenderer]
 
-        serializer.save(conversation=conversation, sender=self.request.user)
+    def get(self, request):
+        throttle_lines = [
+            '# HELP chats_throttle_requests_total Requests allowed and rejected per throttle scope.',
+            '# TYPE chats_throttle_requests_total counter',
+        ]
+        for scope, counts in sorted(throttle_metrics.snapshot().items()):
+            for result, value in counts.items():
+                throttle_lines.append(
+                    f'chats_throttle_requests_total{{scope="{escape(scope)}",result="{result}"}} {value}'
+                )
+        return Response(registry.render(throttle_lines), content_type=PrometheusTextRenderer.content_type)
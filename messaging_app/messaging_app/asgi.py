@@ -2,6 +2,8 @@
 ASGI config for messaging_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections go to the chats live
+update handler.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chats.consumers import conversation_socket  # noqa: E402  (needs apps loaded)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await conversation_socket(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -19,6 +20,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY', 'django-insecure-messaging-app-development-key'
+)
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -37,19 +43,25 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
-    "rest_framework.authentication.BasicAuthentication", 
-    'rest_framework.authentication.SessionAuthentication',
     'chats',
 ]
 
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chats.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'chats.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Reverse proxies in front of the app; the auth throttle keys clients
+    # by IP, and X-Forwarded-For is only trusted this many hops deep (with
+    # 0, REMOTE_ADDR is used and the header is ignored)
+    'NUM_PROXIES': int(os.environ.get('DJANGO_NUM_PROXIES', 0)),
 }
 
 # SimpleJWT settings (optional but good for control)
@@ -59,10 +71,85 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
     "ROTATE_REFRESH_TOKENS": True,
+    # Enforced by chats.auth.RefreshSerializer through chats.revocation
+    # (SimpleJWT's token_blacklist app is not installed)
     "BLACKLIST_AFTER_ROTATION": True,
+    # CustomUser's primary key is user_id, not id
+    "USER_ID_FIELD": "user_id",
+}
+
+# Chats app tuning
+# Seconds to keep conversation membership answers in the Django cache
+# across requests (0 disables; answers are always memoized per request)
+CHATS_MEMBERSHIP_CACHE_TTL = 0
+# Rows per INSERT and maximum items per request for bulk message ingestion
+CHATS_BULK_MESSAGE_BATCH_SIZE = 500
+CHATS_BULK_MESSAGE_MAX_ITEMS = 10000
+# Backend that fans new messages out to WebSocket subscribers, and how many
+# undelivered events a slow socket may buffer before events are dropped
+CHATS_BROADCAST_BACKEND = 'chats.realtime.InMemoryBroadcaster'
+CHATS_BROADCAST_QUEUE_SIZE = 100
+# Upper bounds for the long-poll messages-since endpoint
+CHATS_LONG_POLL_MAX_TIMEOUT = 30
+CHATS_SYNC_MAX_LIMIT = 500
+# Serve message lists from values() rows instead of MessageSerializer
+# (identical output, much less CPU)
+CHATS_FAST_SERIALIZATION = True
+# Rows fetched and encoded per step when streaming conversation exports
+CHATS_EXPORT_CHUNK_SIZE = 2000
+# Full-text search backend for /api/messages/search/ (SQLite FTS5 to match
+# DATABASES; chats.search.PostgresSearchBackend on PostgreSQL)
+CHATS_SEARCH_BACKEND = 'chats.search.SQLiteFTS5SearchBackend'
+# Process-local cache of authenticated users (entries, seconds); a user's
+# deactivation or token revocation reaches other processes within the TTL
+CHATS_AUTH_USER_CACHE_SIZE = 10000
+CHATS_AUTH_USER_CACHE_TTL = 60
+# Refresh-token revocation: Bloom filter sizing, how often each process
+# picks up revocations made by others, and how often expired revocations
+# are deleted (seconds)
+CHATS_REVOCATION_BLOOM_CAPACITY = 100000
+CHATS_REVOCATION_BLOOM_ERROR_RATE = 0.01
+CHATS_REVOCATION_SYNC_INTERVAL = 5
+CHATS_REVOCATION_COMPACT_INTERVAL = 3600
+# PBKDF2 cost for new and upgraded password hashes (Django's default is
+# 600000), threads that compute hashes (0 hashes inline on the request
+# thread) and how many callers may wait for one before getting a 503
+CHATS_PASSWORD_HASH_ITERATIONS = int(os.environ.get('CHATS_PASSWORD_HASH_ITERATIONS', 600000))
+CHATS_PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+CHATS_PASSWORD_HASH_QUEUE = 64
+# Bulk user import: rows validated and inserted per batch, worker processes
+# hashing passwords (0 hashes in-process) and rows per API request
+CHATS_USER_IMPORT_BATCH_SIZE = 1000
+CHATS_USER_IMPORT_WORKERS = os.cpu_count() or 1
+CHATS_USER_IMPORT_MAX_ROWS = 10000
+# Token-bucket throttling of message creation (per sender and per
+# conversation) and of the auth endpoints (per client IP). Each rate is a
+# burst size refilled over the period; drop a scope to leave it unlimited.
+# chats.throttling.CacheTokenBucket shares buckets through CACHES.
+CHATS_THROTTLE_ENABLED = True
+CHATS_THROTTLE_BACKEND = 'chats.throttling.LocalTokenBucket'
+CHATS_THROTTLE_RATES = {
+    'message_user': '120/min',
+    'message_conversation': '600/min',
+    'auth': '30/min',
 }
+# Age in days after which archive_messages moves messages out of the hot
+# table, and messages moved per transaction
+CHATS_MESSAGE_ARCHIVE_AFTER_DAYS = 180
+CHATS_MESSAGE_ARCHIVE_BATCH_SIZE = 1000
+# Message bodies of at least this many bytes are stored compressed (SQLite
+# only), with zstd when the zstandard package is installed, else zlib
+CHATS_MESSAGE_COMPRESSION_THRESHOLD = 1024
+CHATS_MESSAGE_COMPRESSION_CODEC = 'zstd'
+CHATS_MESSAGE_COMPRESSION_LEVEL = 6
+# Share of requests whose queries, DB, serialization and total time and
+# response size are recorded per endpoint and served at /api/metrics/;
+# CHATS_SERVER_TIMING adds those timings to sampled responses
+CHATS_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('CHATS_INSTRUMENTATION_SAMPLE_RATE', 0.1))
+CHATS_SERVER_TIMING = False
 
 MIDDLEWARE = [
+    'chats.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +157,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chats.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'messaging_app.urls'
@@ -98,15 +186,63 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Django's SQLite backend plus the pragmas and transaction_mode
+        # options below
+        'ENGINE': 'chats.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse connections across requests (seconds). Under ASGI set
+        # DJANGO_DB_CONN_MAX_AGE=0: Django cannot reuse connections there
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a connection waits for the write lock before failing
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            # WAL lets readers proceed while a write is in progress;
+            # synchronous=normal is durable across application crashes under
+            # WAL and only risks the last transactions on power loss.
+            # cache_size is in KiB when negative
+            'pragmas': {
+                'journal_mode': 'wal',
+                'synchronous': 'normal',
+                'cache_size': -64000,
+                'mmap_size': 256 * 1024 * 1024,
+                'busy_timeout': 20000,
+                'temp_store': 'memory',
+            },
+        },
     }
 }
 
 
+# Read replicas for conversation, message and user reads (see
+# chats.routers), e.g. local SQLite copies kept up to date by litestream:
+# DJANGO_DB_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+CHATS_READ_REPLICAS = []
+for _n, _path in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{_n}'] = {**DATABASES['default'], 'NAME': _path, 'TEST': {'MIRROR': 'default'}}
+    CHATS_READ_REPLICAS.append(f'replica{_n}')
+# Seconds a user's requests keep reading from the primary after they write,
+# and the cache that remembers them (shared by all processes in production)
+CHATS_REPLICA_PIN_SECONDS = 5
+CHATS_REPLICA_PIN_CACHE = 'default'
+
+DATABASE_ROUTERS = ['chats.routers.ReplicaRouter']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
+# chats' PBKDF2 hasher replaces Django's (same algorithm name, so it must
+# not be listed alongside it); the rest are Django's defaults
+PASSWORD_HASHERS = [
+    'chats.hashers.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',